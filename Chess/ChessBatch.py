@@ -0,0 +1,173 @@
+"""
+Batch analysis of positions from FEN/EPD files or stdin. Positions are read lazily, sent to a pool of worker processes
+in chunks and the results are written out in input order as JSON lines. Only a fixed window of chunks is in flight at
+a time, so memory stays flat however long the input is.
+    python -m Chess.ChessBatch positions.epd --workers 8 --mode search --time 0.1 > results.jsonl
+    cat positions.fen | python -m Chess.ChessBatch --mode legal --perft 2
+    python -m Chess.ChessBatch corpus.fen --mode fen > /dev/null     # FEN import/export round trip check
+"""
+import argparse
+import collections
+import concurrent.futures
+import json
+import multiprocessing
+import sys
+import time
+from Chess import ChessEngine
+from Chess import ChessPerft
+from Chess import ChessSearch
+
+# one searcher per worker process, so its transposition table is allocated once rather than per position
+_searcher = None
+
+
+'''
+Yields (source, lineNumber, text) for every position line in the given files, "-" meaning stdin
+'''
+def readPositions(paths):
+    for path in paths:
+        stream = sys.stdin if path == "-" else open(path)
+        try:
+            for lineNumber, line in enumerate(stream, 1):
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    yield path, lineNumber, line
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+
+'''
+Split an EPD or FEN line into a FEN and the EPD operations, e.g. {"id": "WAC.001", "bm": "Qg6"}
+'''
+def parseLine(line):
+    fields = line.split(None, 4)
+    fen = " ".join(fields[:4])
+    rest = fields[4] if len(fields) > 4 else ""
+    for _ in range(2):      # a FEN's move counters, which EPD operations may follow
+        parts = rest.split(None, 1)
+        if not parts or not parts[0].isdigit():
+            break
+        fen += " " + parts[0]
+        rest = parts[1] if len(parts) > 1 else ""
+    operations = {}
+    if rest:
+        for operation in rest.split(";"):
+            parts = operation.strip().split(None, 1)
+            if parts:
+                operations[parts[0]] = parts[1].strip('"') if len(parts) > 1 else ""
+    return fen, operations
+
+
+'''
+Analyse one position line, returning a JSON-ready dictionary
+'''
+def analysePosition(source, lineNumber, line, options):
+    global _searcher
+    record = {"source": source, "line": lineNumber}
+    try:
+        fen, operations = parseLine(line)
+        record["fen"] = fen
+        if "id" in operations:
+            record["id"] = operations["id"]
+        gs = ChessEngine.GameState.fromFen(fen, options["bitboards"])
+        if options["mode"] == "fen":
+            # export must give back the fields we were given, and loading the export the same position
+            exported = gs.toFen()
+            given = fen.split()
+            record["exported"] = exported
+            record["roundTrip"] = exported.split()[:len(given)] == given and \
+                ChessEngine.GameState.fromFen(exported).hash == gs.hash
+        elif options["mode"] == "legal":
+            record["moves"] = [move.getUciNotation() for move in gs.getValidMoves()]
+            if options["perft"]:
+                record["perft"] = ChessPerft.perft(gs, options["perft"])
+        else:
+            if _searcher is None:
+                _searcher = ChessSearch.Searcher(options["hash"])
+            result = _searcher.search(gs, options["time"], options["nodes"], options["depth"])
+            record.update({"bestmove": result.bestMove.getUciNotation() if result.bestMove is not None else None,
+                           "score": result.score, "depth": result.depth, "nodes": result.nodes,
+                           "pv": [move.getUciNotation() for move in result.pv]})
+    except (ValueError, KeyError, IndexError) as e:     # malformed line, report it and carry on
+        record["error"] = f"{type(e).__name__}: {e}"
+    return record
+
+
+def analyseChunk(chunk, options):
+    return [analysePosition(source, lineNumber, line, options) for source, lineNumber, line in chunk]
+
+
+'''
+Group the positions into lists of up to size, lazily
+'''
+def chunked(positions, size):
+    chunk = []
+    for position in positions:
+        chunk.append(position)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+'''
+Run function(chunk, *args) over chunks of items on a pool of worker processes, yielding the items of the lists it
+returns in input order. At most workers * 4 chunks are queued or running at once, so memory stays flat however long
+the input is. function must be picklable, i.e. defined at the top of a module.
+'''
+def mapChunks(function, items, args=(), workers=None, chunkSize=32):
+    workers = workers or multiprocessing.cpu_count()
+    pending = collections.deque()
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        for chunk in chunked(items, chunkSize):
+            pending.append(pool.submit(function, chunk, *args))
+            if len(pending) >= workers * 4:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+'''
+Analyse positions on a pool of worker processes, yielding the result records in input order
+'''
+def analyse(positions, options, workers=None, chunkSize=32):
+    return mapChunks(analyseChunk, positions, (options,), workers, chunkSize)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyse FEN/EPD positions in parallel, writing JSON lines")
+    parser.add_argument("files", nargs="*", default=["-"], help="FEN/EPD files, - for stdin (the default)")
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--mode", choices=("legal", "search", "fen"), default="legal")
+    parser.add_argument("--perft", type=int, default=0, help="legal mode: also count nodes to this depth")
+    parser.add_argument("--time", type=float, help="search mode: seconds per position")
+    parser.add_argument("--nodes", type=int, help="search mode: nodes per position")
+    parser.add_argument("--depth", type=int, help="search mode: depth limit")
+    parser.add_argument("--hash", type=int, default=16, help="search mode: transposition table MB per worker")
+    parser.add_argument("--chunk", type=int, default=32, help="positions sent to a worker at a time")
+    parser.add_argument("--bitboards", action="store_true", help="use the bitboard backend")
+    args = parser.parse_args()
+    if args.mode == "search" and args.time is None and args.nodes is None and args.depth is None:
+        parser.error("search mode needs a --time, --nodes or --depth budget")
+
+    options = {"mode": args.mode, "perft": args.perft, "time": args.time, "nodes": args.nodes,
+               "depth": args.depth or ChessSearch.MAX_PLY - 1, "hash": args.hash, "bitboards": args.bitboards}
+    start = time.perf_counter()
+    count = 0
+    failures = 0
+    for record in analyse(readPositions(args.files), options, args.workers, args.chunk):
+        sys.stdout.write(json.dumps(record) + "\n")
+        count += 1
+        if "error" in record or record.get("roundTrip") is False:
+            failures += 1
+    elapsed = time.perf_counter() - start
+    sys.stderr.write(f"{count} positions in {elapsed:.2f}s ({count / elapsed if elapsed > 0 else 0:,.1f} positions/s)\n")
+    if args.mode == "fen":
+        sys.stderr.write(f"{failures} failed the round trip\n")
+        sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
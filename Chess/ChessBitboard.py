@@ -0,0 +1,381 @@
+"""
+This is a second board backend for GameState. It keeps one 64-bit bitboard for each of the twelve pieces and uses
+precomputed attack tables to generate the valid moves, instead of walking the 8x8 list square by square.
+Squares are numbered row*8 + col, the same way GameState.board is laid out, so square 0 is a8 and square 63 is h1.
+"""
+
+FULL = 0xFFFFFFFFFFFFFFFF
+PIECES = ['wP', 'wR', 'wN', 'wB', 'wQ', 'wK', 'bP', 'bR', 'bN', 'bB', 'bQ', 'bK']
+
+ROOK_DIRECTIONS = ((-1, 0), (0, -1), (1, 0), (0, 1))
+BISHOP_DIRECTIONS = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+KNIGHT_OFFSETS = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+KING_OFFSETS = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+
+# generated moves are packed into an int: start square (6 bits) | end square (6 bits) << 6 | flags
+ENPASSANT_FLAG = 1 << 12
+PROMOTION_SHIFT = 13    # 1-4 in these bits for a promotion to Move.promotionPieces[0-3], i.e. Q, R, B, N
+
+# castling rights bitmask
+WHITE_KINGSIDE = 1
+WHITE_QUEENSIDE = 2
+BLACK_KINGSIDE = 4
+BLACK_QUEENSIDE = 8
+# per side: (right, king from, king to, rook from, rook to, squares that must be empty, squares that must not be attacked)
+CASTLES = {"w": ((WHITE_KINGSIDE, 60, 62, 63, 61, (1 << 61) | (1 << 62), (1 << 60) | (1 << 61) | (1 << 62)),
+                 (WHITE_QUEENSIDE, 60, 58, 56, 59, (1 << 57) | (1 << 58) | (1 << 59), (1 << 60) | (1 << 59) | (1 << 58))),
+           "b": ((BLACK_KINGSIDE, 4, 6, 7, 5, (1 << 5) | (1 << 6), (1 << 4) | (1 << 5) | (1 << 6)),
+                 (BLACK_QUEENSIDE, 4, 2, 0, 3, (1 << 1) | (1 << 2) | (1 << 3), (1 << 4) | (1 << 3) | (1 << 2)))}
+CASTLE_ROOK_MOVES = {62: (63, 61), 58: (56, 59), 6: (7, 5), 2: (0, 3)}  # king's landing square: rook from, rook to
+# rights kept when a piece moves from or to each square, so a king or rook move, or a rook capture, clears them in O(1)
+CASTLING_MASKS = [15] * 64
+CASTLING_MASKS[0] = 15 & ~BLACK_QUEENSIDE
+CASTLING_MASKS[4] = 15 & ~(BLACK_KINGSIDE | BLACK_QUEENSIDE)
+CASTLING_MASKS[7] = 15 & ~BLACK_KINGSIDE
+CASTLING_MASKS[56] = 15 & ~WHITE_QUEENSIDE
+CASTLING_MASKS[60] = 15 & ~(WHITE_KINGSIDE | WHITE_QUEENSIDE)
+CASTLING_MASKS[63] = 15 & ~WHITE_KINGSIDE
+
+
+'''
+Returns a bitboard of the squares reached by stepping once by each offset from row, col
+'''
+def stepAttacks(row, col, offsets):
+    attacks = 0
+    for dr, dc in offsets:
+        if 0 <= row + dr < 8 and 0 <= col + dc < 8:
+            attacks |= 1 << ((row + dr) * 8 + col + dc)
+    return attacks
+
+
+'''
+Returns a bitboard of the squares a slider on row, col reaches along the given directions, stopping at the first blocker in occupied
+'''
+def slidingAttacks(row, col, directions, occupied):
+    attacks = 0
+    for dr, dc in directions:
+        r, c = row + dr, col + dc
+        while 0 <= r < 8 and 0 <= c < 8:
+            attacks |= 1 << (r * 8 + c)
+            if occupied & (1 << (r * 8 + c)):
+                break
+            r, c = r + dr, c + dc
+    return attacks
+
+
+'''
+Returns the blocker mask for one line (a pair of opposite directions) through row, col.
+The last square in each direction is left out, since a piece there can never block anything further along.
+'''
+def lineMask(row, col, direction):
+    mask = 0
+    for dr, dc in (direction, (-direction[0], -direction[1])):
+        r, c = row + dr, col + dc
+        while 0 <= r + dr < 8 and 0 <= c + dc < 8:
+            mask |= 1 << (r * 8 + c)
+            r, c = r + dr, c + dc
+    return mask
+
+
+'''
+Builds an occupancy-indexed attack table for one line through row, col: {blockers: attacks} for every subset of the line's mask
+'''
+def lineTable(row, col, direction):
+    mask = lineMask(row, col, direction)
+    directions = (direction, (-direction[0], -direction[1]))
+    table = {}
+    subset = 0
+    while True:  # carry-rippler trick enumerates every subset of mask
+        table[subset] = slidingAttacks(row, col, directions, subset)
+        subset = (subset - mask) & mask
+        if subset == 0:
+            break
+    return mask, table
+
+
+KNIGHT_ATTACKS = [stepAttacks(sq // 8, sq % 8, KNIGHT_OFFSETS) for sq in range(64)]
+KING_ATTACKS = [stepAttacks(sq // 8, sq % 8, KING_OFFSETS) for sq in range(64)]
+# PAWN_ATTACKS[colour][sq] are the squares a pawn of that colour on sq attacks
+PAWN_ATTACKS = {"w": [stepAttacks(sq // 8, sq % 8, ((-1, -1), (-1, 1))) for sq in range(64)],
+                "b": [stepAttacks(sq // 8, sq % 8, ((1, -1), (1, 1))) for sq in range(64)]}
+
+# one (mask, table) pair per line through each square: rank, file, diagonal and anti-diagonal
+RANK_TABLES = [lineTable(sq // 8, sq % 8, (0, 1)) for sq in range(64)]
+FILE_TABLES = [lineTable(sq // 8, sq % 8, (1, 0)) for sq in range(64)]
+DIAGONAL_TABLES = [lineTable(sq // 8, sq % 8, (1, 1)) for sq in range(64)]
+ANTI_DIAGONAL_TABLES = [lineTable(sq // 8, sq % 8, (1, -1)) for sq in range(64)]
+
+
+'''
+Squares strictly between two squares on a common line (BETWEEN) and the whole board line through both (LINE), 0 if not aligned
+'''
+def lineTables():
+    between = [[0] * 64 for _ in range(64)]
+    line = [[0] * 64 for _ in range(64)]
+    for sq in range(64):
+        row, col = sq // 8, sq % 8
+        for dr, dc in ROOK_DIRECTIONS + BISHOP_DIRECTIONS:
+            fullLine = slidingAttacks(row, col, ((dr, dc), (-dr, -dc)), 0) | (1 << sq)
+            path = 0
+            r, c = row + dr, col + dc
+            while 0 <= r < 8 and 0 <= c < 8:
+                between[sq][r * 8 + c] = path
+                line[sq][r * 8 + c] = fullLine
+                path |= 1 << (r * 8 + c)
+                r, c = r + dr, c + dc
+    return between, line
+
+
+BETWEEN, LINE = lineTables()
+
+
+def rookAttacks(sq, occupied):
+    rankMask, rankTable = RANK_TABLES[sq]
+    fileMask, fileTable = FILE_TABLES[sq]
+    return rankTable[occupied & rankMask] | fileTable[occupied & fileMask]
+
+
+def bishopAttacks(sq, occupied):
+    diagMask, diagTable = DIAGONAL_TABLES[sq]
+    antiMask, antiTable = ANTI_DIAGONAL_TABLES[sq]
+    return diagTable[occupied & diagMask] | antiTable[occupied & antiMask]
+
+
+'''
+Append a pawn move's code, or one code per promotion piece when it lands on the last rank
+'''
+def appendPawnMove(moves, code, promotes):
+    if promotes:
+        moves.extend([code | (piece << PROMOTION_SHIFT) for piece in range(1, 5)])
+    else:
+        moves.append(code)
+
+
+'''
+Yields the square index of each set bit in bb, lowest first
+'''
+def squares(bb):
+    while bb:
+        lsb = bb & -bb
+        yield lsb.bit_length() - 1
+        bb ^= lsb
+
+
+'''
+This class stores the twelve piece bitboards for a position and generates the valid moves from them.
+GameState keeps it in step with its board list through makeMove and undoMove.
+Without a board it starts empty, for callers that place the pieces themselves with addPiece.
+'''
+class Bitboards():
+    def __init__(self, board=None):
+        self.pieces = {piece: 0 for piece in PIECES}
+        self.colours = {"w": 0, "b": 0}
+        if board is not None:
+            for row in range(8):
+                for col in range(8):
+                    if board[row][col] != "--":
+                        self.addPiece(board[row][col], row * 8 + col)
+
+    def addPiece(self, piece, sq):
+        self.pieces[piece] |= 1 << sq
+        self.colours[piece[0]] |= 1 << sq
+
+    def removePiece(self, piece, sq):
+        self.pieces[piece] &= ~(1 << sq)
+        self.colours[piece[0]] &= ~(1 << sq)
+
+    '''
+    Mirrors GameState.makeMove. placedPiece is what ended up on the landing square (the promoted piece for promotions)
+    '''
+    def makeMove(self, move, placedPiece):
+        self.removePiece(move.pieceMoved, move.startRow * 8 + move.startCol)
+        if move.isEnpassantMove:
+            self.removePiece(move.pieceCaptured, move.startRow * 8 + move.endCol)
+        elif move.pieceCaptured != "--":
+            self.removePiece(move.pieceCaptured, move.endRow * 8 + move.endCol)
+        self.addPiece(placedPiece, move.endRow * 8 + move.endCol)
+        if move.isCastleMove:
+            rookFrom, rookTo = CASTLE_ROOK_MOVES[move.endRow * 8 + move.endCol]
+            self.removePiece(move.pieceMoved[0] + "R", rookFrom)
+            self.addPiece(move.pieceMoved[0] + "R", rookTo)
+
+    '''
+    Mirrors GameState.undoMove, placedPiece being the piece that was on the landing square before the undo
+    '''
+    def undoMove(self, move, placedPiece):
+        self.removePiece(placedPiece, move.endRow * 8 + move.endCol)
+        if move.isEnpassantMove:
+            self.addPiece(move.pieceCaptured, move.startRow * 8 + move.endCol)
+        elif move.pieceCaptured != "--":
+            self.addPiece(move.pieceCaptured, move.endRow * 8 + move.endCol)
+        self.addPiece(move.pieceMoved, move.startRow * 8 + move.startCol)
+        if move.isCastleMove:
+            rookFrom, rookTo = CASTLE_ROOK_MOVES[move.endRow * 8 + move.endCol]
+            self.removePiece(move.pieceMoved[0] + "R", rookTo)
+            self.addPiece(move.pieceMoved[0] + "R", rookFrom)
+
+    '''
+    Returns a bitboard of the pieces of colour byColour that attack sq, given the occupancy occupied
+    '''
+    def attackersOf(self, sq, byColour, occupied):
+        p = self.pieces
+        other = "b" if byColour == "w" else "w"
+        return (KNIGHT_ATTACKS[sq] & p[byColour + "N"]) | \
+               (KING_ATTACKS[sq] & p[byColour + "K"]) | \
+               (PAWN_ATTACKS[other][sq] & p[byColour + "P"]) | \
+               (bishopAttacks(sq, occupied) & (p[byColour + "B"] | p[byColour + "Q"])) | \
+               (rookAttacks(sq, occupied) & (p[byColour + "R"] | p[byColour + "Q"]))
+
+    '''
+    Bitboard of every square the pieces of colour attack. The other side's king doesn't block, so a square behind it
+    on an attacking line counts as attacked and the king can't step back along the line out of check.
+    '''
+    def attackMap(self, colour):
+        p = self.pieces
+        other = "b" if colour == "w" else "w"
+        occupied = (self.colours["w"] | self.colours["b"]) & ~p[other + "K"]
+        attacks = KING_ATTACKS[p[colour + "K"].bit_length() - 1] if p[colour + "K"] else 0
+        for sq in squares(p[colour + "P"]):
+            attacks |= PAWN_ATTACKS[colour][sq]
+        for sq in squares(p[colour + "N"]):
+            attacks |= KNIGHT_ATTACKS[sq]
+        for sq in squares(p[colour + "B"] | p[colour + "Q"]):
+            attacks |= bishopAttacks(sq, occupied)
+        for sq in squares(p[colour + "R"] | p[colour + "Q"]):
+            attacks |= rookAttacks(sq, occupied)
+        return attacks
+
+    '''
+    Append the castling moves side us has: the right is held, the king and rook are home, the squares between them
+    are empty and the king doesn't start, pass or land on an attacked square
+    '''
+    def appendCastleMoves(self, moves, us, castlingRights):
+        occupied = self.colours["w"] | self.colours["b"]
+        enemyAttacks = None
+        for right, kingFrom, kingTo, rookFrom, rookTo, empty, safe in CASTLES[us]:
+            if castlingRights & right and self.pieces[us + "K"] & (1 << kingFrom) and \
+                    self.pieces[us + "R"] & (1 << rookFrom) and not occupied & empty:
+                if enemyAttacks is None:
+                    enemyAttacks = self.attackMap("b" if us == "w" else "w")
+                if not enemyAttacks & safe:
+                    moves.append(kingFrom | kingTo << 6)
+
+    def kingAttacked(self, colour):
+        kingSq = self.pieces[colour + "K"].bit_length() - 1
+        return self.attackersOf(kingSq, "b" if colour == "w" else "w", self.colours["w"] | self.colours["b"]) != 0
+
+    '''
+    Generates pseudo-legal moves as packed ints, ignoring pins and checks. With captures it returns the captures,
+    en passant captures and all promotions, otherwise the remaining quiet moves including castling.
+    '''
+    def generatePseudoLegalMoves(self, whiteToMove, enpassantSq, captures, castlingRights=0):
+        us, them = ("w", "b") if whiteToMove else ("b", "w")
+        p = self.pieces
+        ours = self.colours[us]
+        theirs = self.colours[them]
+        occupied = ours | theirs
+        targets = theirs if captures else ~occupied & FULL
+        moves = []
+        for frm in squares(p[us + "N"]):
+            for to in squares(KNIGHT_ATTACKS[frm] & targets):
+                moves.append(frm | to << 6)
+        for frm in squares(p[us + "B"] | p[us + "Q"]):
+            for to in squares(bishopAttacks(frm, occupied) & targets):
+                moves.append(frm | to << 6)
+        for frm in squares(p[us + "R"] | p[us + "Q"]):
+            for to in squares(rookAttacks(frm, occupied) & targets):
+                moves.append(frm | to << 6)
+        for frm in squares(p[us + "K"]):
+            for to in squares(KING_ATTACKS[frm] & targets):
+                moves.append(frm | to << 6)
+
+        forward, startRow, lastRow = (-8, 6, 0) if whiteToMove else (8, 1, 7)
+        for frm in squares(p[us + "P"]):
+            one = frm + forward
+            promotes = one // 8 == lastRow
+            if captures:
+                if promotes and not occupied & (1 << one):
+                    appendPawnMove(moves, frm | one << 6, True)
+                for to in squares(PAWN_ATTACKS[us][frm] & theirs):
+                    appendPawnMove(moves, frm | to << 6, promotes)
+                if enpassantSq is not None and PAWN_ATTACKS[us][frm] & (1 << enpassantSq):
+                    moves.append(frm | enpassantSq << 6 | ENPASSANT_FLAG)
+            elif not promotes and not occupied & (1 << one):
+                moves.append(frm | one << 6)
+                two = one + forward
+                if frm // 8 == startRow and not occupied & (1 << two):
+                    moves.append(frm | two << 6)
+        if not captures and castlingRights:
+            self.appendCastleMoves(moves, us, castlingRights)
+        return moves
+
+    '''
+    Generates the valid moves as packed ints: startSq | endSq << 6, plus ENPASSANT_FLAG or a promotion piece.
+    Returns the moves together with whether the side to move is in check.
+    '''
+    def generateMoves(self, whiteToMove, enpassantSq, castlingRights=0):
+        us, them = ("w", "b") if whiteToMove else ("b", "w")
+        p = self.pieces
+        ours = self.colours[us]
+        theirs = self.colours[them]
+        occupied = ours | theirs
+        kingSq = p[us + "K"].bit_length() - 1
+        moves = []
+
+        # king moves first: the king may not step onto an attacked square, looking through its own square for sliders
+        occupiedNoKing = occupied & ~(1 << kingSq)
+        for to in squares(KING_ATTACKS[kingSq] & ~ours):
+            if not self.attackersOf(to, them, occupiedNoKing):
+                moves.append(kingSq | to << 6)
+
+        checkers = self.attackersOf(kingSq, them, occupied)
+        if checkers & (checkers - 1):  # double check, king has to move
+            return moves, True
+        if checkers:  # single check, capture the checker or block the line
+            checkerSq = checkers.bit_length() - 1
+            targets = checkers | BETWEEN[kingSq][checkerSq]
+        else:
+            targets = FULL
+
+        # pinned pieces may only move along the line between the king and the pinning piece
+        pinLines = {}
+        snipers = (rookAttacks(kingSq, theirs) & (p[them + "R"] | p[them + "Q"])) | \
+                  (bishopAttacks(kingSq, theirs) & (p[them + "B"] | p[them + "Q"]))
+        for sniper in squares(snipers):
+            blockers = BETWEEN[kingSq][sniper] & occupied
+            if blockers and not blockers & (blockers - 1) and blockers & ours:
+                pinLines[blockers.bit_length() - 1] = LINE[kingSq][sniper]
+
+        notOurs = ~ours & targets
+        for frm in squares(p[us + "N"]):
+            if frm not in pinLines:  # a pinned knight can never move
+                for to in squares(KNIGHT_ATTACKS[frm] & notOurs):
+                    moves.append(frm | to << 6)
+        for frm in squares(p[us + "B"] | p[us + "Q"]):
+            for to in squares(bishopAttacks(frm, occupied) & notOurs & pinLines.get(frm, FULL)):
+                moves.append(frm | to << 6)
+        for frm in squares(p[us + "R"] | p[us + "Q"]):
+            for to in squares(rookAttacks(frm, occupied) & notOurs & pinLines.get(frm, FULL)):
+                moves.append(frm | to << 6)
+
+        forward, startRow, lastRow = (-8, 6, 0) if whiteToMove else (8, 1, 7)
+        for frm in squares(p[us + "P"]):
+            allowed = targets & pinLines.get(frm, FULL)
+            one = frm + forward
+            if not occupied & (1 << one):
+                if allowed & (1 << one):
+                    appendPawnMove(moves, frm | one << 6, one // 8 == lastRow)
+                two = one + forward
+                if frm // 8 == startRow and not occupied & (1 << two) and allowed & (1 << two):
+                    moves.append(frm | two << 6)
+            for to in squares(PAWN_ATTACKS[us][frm] & theirs & allowed):
+                appendPawnMove(moves, frm | to << 6, to // 8 == lastRow)
+            if enpassantSq is not None and PAWN_ATTACKS[us][frm] & (1 << enpassantSq):
+                capturedSq = enpassantSq - forward
+                # the capture removes two pawns from the board, so test the resulting position for checks directly
+                after = (occupied ^ (1 << frm) ^ (1 << capturedSq)) | (1 << enpassantSq)
+                if not (self.attackersOf(kingSq, them, after) & ~(1 << capturedSq)):
+                    moves.append(frm | enpassantSq << 6 | ENPASSANT_FLAG)
+        if not checkers and castlingRights:
+            self.appendCastleMoves(moves, us, castlingRights)
+        return moves, bool(checkers)
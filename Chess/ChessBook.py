@@ -0,0 +1,209 @@
+"""
+Opening book. A book is a file of fixed-size entries sorted by position hash, in the style of Polyglot books:
+    key (8 bytes) | moveID (2 bytes) | weight (2 bytes) | learn (4 bytes), all big-endian
+key is the GameState's Zobrist hash, moveID the Move's, and weight how often the move was played from there.
+Lookups memory-map the file and binary search it, so opening a book costs nothing however large it is and the OS
+only pages in the few blocks a lookup touches.
+Books are built from PGN files. Move counts are gathered in memory up to a limit, spilled to sorted run files when
+it's reached, and the runs are merged into the book at the end, so the games can be far larger than memory.
+    python -m Chess.ChessBook build games.pgn more.pgn --out book.bin --plies 20
+    python -m Chess.ChessBook probe book.bin --fen "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1"
+"""
+import argparse
+import heapq
+import mmap
+import os
+import random
+import struct
+import sys
+import tempfile
+import time
+from Chess import ChessEngine
+from Chess import ChessPgn
+
+ENTRY = struct.Struct(">QHHI")
+KEY = struct.Struct(">Q")
+MAX_WEIGHT = 0xFFFF
+
+
+'''
+This class looks positions up in a book file. Call close() when done with it.
+'''
+class OpeningBook():
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        size = os.fstat(self.file.fileno()).st_size
+        # an empty file can't be mapped, and has nothing to find anyway
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        self.entries = size // ENTRY.size
+
+    def close(self):
+        if self.map is not None:   # mapped even when it's too short to hold an entry
+            self.map.close()
+        self.file.close()
+
+    '''
+    [(moveID, weight), ...] stored for the position with this hash, heaviest first
+    '''
+    def probe(self, key):
+        low, high = 0, self.entries
+        while low < high:   # first entry with a key >= the one we want
+            middle = (low + high) // 2
+            if KEY.unpack_from(self.map, middle * ENTRY.size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        moves = []
+        while low < self.entries:
+            entryKey, moveID, weight, learn = ENTRY.unpack_from(self.map, low * ENTRY.size)
+            if entryKey != key:
+                break
+            moves.append((moveID, weight))
+            low += 1
+        moves.sort(key=lambda entry: entry[1], reverse=True)
+        return moves
+
+    '''
+    [(Move, weight), ...] for the legal book moves in gs, heaviest first. Moves that aren't legal, from a hash
+    collision, are left out.
+    '''
+    def getMoves(self, gs):
+        entries = self.probe(gs.hash)
+        if not entries:
+            return []
+        legal = {move.moveID: move for move in gs.getValidMoves()}
+        return [(legal[moveID], weight) for moveID, weight in entries if moveID in legal]
+
+    '''
+    A book move for gs picked at random in proportion to the weights, or the heaviest if rng is None.
+    Returns None when the position isn't in the book.
+    '''
+    def chooseMove(self, gs, rng=random):
+        moves = self.getMoves(gs)
+        if not moves:
+            return None
+        if rng is None:
+            return moves[0][0]
+        return rng.choices([move for move, weight in moves], [weight + 1 for move, weight in moves])[0]
+
+
+'''
+Writes sorted runs of (key, moveID, count) entries to temporary files, then merges them into a book
+'''
+class BookBuilder():
+    def __init__(self, maxEntries=1000000, tempDir=None):
+        self.maxEntries = maxEntries
+        self.tempDir = tempDir
+        self.counts = {}    # (key, moveID): times played
+        self.runs = []
+
+    def add(self, key, moveID):
+        entry = (key, moveID)
+        self.counts[entry] = self.counts.get(entry, 0) + 1
+        if len(self.counts) >= self.maxEntries:
+            self.spill()
+
+    def spill(self):
+        run = tempfile.TemporaryFile(dir=self.tempDir)
+        for (key, moveID), count in sorted(self.counts.items()):
+            run.write(ENTRY.pack(key, moveID, min(count, MAX_WEIGHT), count))  # learn holds the full count until the merge
+        run.seek(0)
+        self.runs.append(run)
+        self.counts = {}
+
+    '''
+    Merge the runs into the book file at path, leaving out moves played fewer than minCount times.
+    Returns the number of entries written.
+    '''
+    def write(self, path, minCount=1):
+        if self.counts or not self.runs:
+            self.spill()
+        written = 0
+        with open(path, "wb") as out:
+            merged = heapq.merge(*(readRun(run) for run in self.runs))
+            current, total = None, 0
+            for key, moveID, count in merged:
+                if (key, moveID) != current:
+                    if current is not None and total >= minCount:
+                        out.write(ENTRY.pack(current[0], current[1], min(total, MAX_WEIGHT), 0))
+                        written += 1
+                    current, total = (key, moveID), 0
+                total += count
+            if current is not None and total >= minCount:
+                out.write(ENTRY.pack(current[0], current[1], min(total, MAX_WEIGHT), 0))
+                written += 1
+        for run in self.runs:
+            run.close()
+        self.runs = []
+        return written
+
+
+def readRun(run):
+    while True:
+        data = run.read(ENTRY.size * 4096)
+        if not data:
+            return
+        for key, moveID, weight, count in ENTRY.iter_unpack(data):
+            yield key, moveID, count
+
+
+'''
+Add the first plies moves of every game in the PGN files to the builder. Returns (games, skipped), skipped being
+games with a move that couldn't be read, whose moves up to it are still added.
+'''
+def addGames(builder, paths, plies):
+    games = skipped = 0
+    for path in paths:
+        with open(path, errors="replace") as stream:
+            for tags, sanMoves in ChessPgn.readGames(stream):
+                games += 1
+                try:
+                    for gs, move in ChessPgn.replayGame(tags, sanMoves[:plies]):
+                        builder.add(gs.hash, move.moveID)
+                except ValueError:
+                    skipped += 1
+    return games, skipped
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query an opening book")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="build a book from PGN files")
+    build.add_argument("pgn", nargs="+")
+    build.add_argument("--out", required=True, help="book file to write")
+    build.add_argument("--plies", type=int, default=20, help="moves from the start of each game to include")
+    build.add_argument("--min-count", type=int, default=1, help="leave out moves played fewer times than this")
+    build.add_argument("--memory-entries", type=int, default=1000000, help="entries to count in memory between spills")
+    probe = commands.add_parser("probe", help="list the book moves for a position")
+    probe.add_argument("book")
+    probe.add_argument("--fen", default=ChessEngine.START_FEN)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        start = time.perf_counter()
+        builder = BookBuilder(args.memory_entries)
+        games, skipped = addGames(builder, args.pgn, args.plies)
+        written = builder.write(args.out, args.min_count)
+        print(f"{games} games ({skipped} with unreadable moves), {written} entries in {time.perf_counter() - start:.2f}s")
+        return
+    book = OpeningBook(args.book)
+    try:
+        gs = ChessEngine.GameState.fromFen(args.fen)
+        repeats = 10000
+        start = time.perf_counter()
+        for _ in range(repeats):
+            book.probe(gs.hash)
+        elapsed = time.perf_counter() - start
+        moves = book.getMoves(gs)
+        total = sum(weight for move, weight in moves)
+        for move, weight in moves:
+            print(f"{move.getUciNotation()} weight {weight} ({weight / total:.1%})")
+        if not moves:
+            print("not in book", file=sys.stderr)
+        print(f"{book.entries} entries, lookup {elapsed / repeats * 1e6:.1f} microseconds")
+    finally:
+        book.close()
+
+
+if __name__ == "__main__":
+    main()
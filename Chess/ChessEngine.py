@@ -1,5 +1,17 @@
-###   !!! TODO: can't yet castle !!!    ###
-
+from Chess import ChessBitboard
+from Chess import ChessEvaluation
+from Chess import ChessZobrist
+from Chess.ChessBitboard import WHITE_KINGSIDE, WHITE_QUEENSIDE, BLACK_KINGSIDE, BLACK_QUEENSIDE
+
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+CASTLING_LETTERS = (("K", WHITE_KINGSIDE), ("Q", WHITE_QUEENSIDE), ("k", BLACK_KINGSIDE), ("q", BLACK_QUEENSIDE))
+FEN_PIECES = {"P": "wP", "R": "wR", "N": "wN", "B": "wB", "Q": "wQ", "K": "wK",
+              "p": "bP", "r": "bR", "n": "bN", "b": "bB", "q": "bQ", "k": "bK"}
+PIECES_FEN = {v: k for k, v in FEN_PIECES.items()}
+# state makeMove can't be undone from the move alone, saved per ply in GameState.undoStack at these offsets
+UNDO_ENPASSANT, UNDO_CASTLING, UNDO_HALFMOVE, UNDO_HASH, UNDO_PAWN_HASH, UNDO_MG, UNDO_EG, UNDO_PHASE = range(8)
+UNDO_FIELDS = 8
+UNDO_STACK_PLIES = 256  # preallocated, doubled if a game runs longer
 
 """
 This class is responsible for storing all the information about the current state of a chess game.
@@ -7,7 +19,7 @@ It will also be responsible for determining the valid moves at the current state
 It will also keep a move log.
 """
 class GameState():
-    def __init__(self):
+    def __init__(self, useBitboards=False, fen=None):
         # board is an 8x8 2d list, each element of the list has 2 characers.
         # The first character represents the colour of the piece, 'b' or 'w'
         # The second character represents the type of the piece, 'K', 'Q', 'R', 'B', 'N' or 'p'
@@ -15,7 +27,7 @@ class GameState():
         # NB using numpy array might be more efficient
         self.board = [
             ["bR", "bN", "bB", "bQ", "bK", "bB", "bN", "bR"],
-            ["bP", "wP", "bP", "bP", "bP", "bP", "bP", "bP"],
+            ["bP", "bP", "bP", "bP", "bP", "bP", "bP", "bP"],
             ["--", "--", "--", "--", "--", "--", "--", "--"],
             ["--", "--", "--", "--", "--", "--", "--", "--"],
             ["--", "--", "--", "--", "--", "--", "--", "--"],
@@ -34,17 +46,125 @@ class GameState():
         self.checkMate = False
         self.staleMate = False
         self.enpassantPossible = ()  # coordinates for the square where en passant is possible
+        self.castlingRights = WHITE_KINGSIDE | WHITE_QUEENSIDE | BLACK_KINGSIDE | BLACK_QUEENSIDE
+        self.halfmoveClock = 0      # plies since the last capture or pawn move
+        self.fullmoveNumber = 1
+        # the irreversible state from before each move in moveLog, UNDO_FIELDS slots per ply, so undoMove restores
+        # it exactly. Filled in place rather than appended to, so making moves in a search allocates nothing here.
+        self.undoStack = [None] * (UNDO_STACK_PLIES * UNDO_FIELDS)
+        if fen is not None:
+            self.setFen(fen)
+        # optional second backend: twelve piece bitboards kept in step with self.board, used by getValidMoves
+        self.bitboards = ChessBitboard.Bitboards(self.board) if useBitboards else None
+        self.hash = ChessZobrist.computeHash(self)  # 64-bit Zobrist key, updated incrementally by makeMove and undoMove
+        self.pawnHash = ChessZobrist.computePawnHash(self)  # the same over the pawns only, for the pawn evaluation cache
+        # white's middlegame and endgame material plus piece-square totals and the game phase, also kept incrementally
+        self.mgScore, self.egScore, self.phase = ChessEvaluation.computeScores(self)
+        self.attackMaps = None      # {"w": bitboard, "b": bitboard} of the squares each side attacks, see getAttackMap
+        self.attackMapsHash = None  # hash of the position attackMaps was computed for
+        self.logger = None  # optional callback taking a line of move notation, e.g. print. The engine itself is silent
+
+    '''
+    Set up a position from a FEN string
+    '''
+    @classmethod
+    def fromFen(cls, fen, useBitboards=False):
+        return cls(useBitboards, fen)
+
+    '''
+    Read the position straight into the board and state fields (called from __init__, before the derived state is built)
+    '''
+    def setFen(self, fen):
+        fields = fen.split()
+        if len(fields) < 4:
+            raise ValueError("FEN needs at least 4 fields: " + fen)
+        ranks = fields[0].split("/")
+        if len(ranks) != 8:
+            raise ValueError("FEN placement needs 8 ranks: " + fields[0])
+        self.board = []
+        for row in range(8):
+            rank = []
+            for char in ranks[row]:
+                if char.isdigit():
+                    rank.extend(["--"] * int(char))
+                elif char in FEN_PIECES:
+                    rank.append(FEN_PIECES[char])
+                    if char == "K":
+                        self.whiteKingLocation = (row, len(rank) - 1)
+                    elif char == "k":
+                        self.blackKingLocation = (row, len(rank) - 1)
+                else:
+                    raise ValueError("unknown piece in FEN: " + char)
+            if len(rank) != 8:
+                raise ValueError("FEN rank doesn't have 8 squares: " + ranks[row])
+            self.board.append(rank)
+        if fields[0].count("K") != 1 or fields[0].count("k") != 1:
+            raise ValueError("FEN needs one king of each colour: " + fields[0])
+        if fields[1] not in ("w", "b"):
+            raise ValueError("FEN side to move must be w or b: " + fields[1])
+        self.whiteToMove = fields[1] == "w"
+        self.castlingRights = 0
+        for letter, right in CASTLING_LETTERS:
+            if letter in fields[2]:
+                self.castlingRights |= right
+        for colour in ("w", "b"):   # drop any right whose king or rook isn't on its starting square
+            for right, kingFrom, kingTo, rookFrom, rookTo, empty, safe in ChessBitboard.CASTLES[colour]:
+                if self.board[kingFrom // 8][kingFrom % 8] != colour + "K" or self.board[rookFrom // 8][rookFrom % 8] != colour + "R":
+                    self.castlingRights &= ~right
+        if fields[3] == "-":
+            self.enpassantPossible = ()
+        elif len(fields[3]) == 2 and fields[3][0] in Move.filesToCols and fields[3][1] in ("3", "6"):
+            self.enpassantPossible = (Move.ranksToRows[fields[3][1]], Move.filesToCols[fields[3][0]])
+        else:
+            raise ValueError("FEN en passant square must be - or on the 3rd or 6th rank: " + fields[3])
+        self.halfmoveClock = int(fields[4]) if len(fields) > 4 else 0
+        self.fullmoveNumber = int(fields[5]) if len(fields) > 5 else 1
 
+    '''
+    The current position as a FEN string
+    '''
+    def toFen(self):
+        ranks = []
+        for row in self.board:
+            rank = ""
+            empty = 0
+            for piece in row:
+                if piece == "--":
+                    empty += 1
+                else:
+                    rank += (str(empty) if empty else "") + PIECES_FEN[piece]
+                    empty = 0
+            ranks.append(rank + (str(empty) if empty else ""))
+        castling = "".join(letter for letter, right in CASTLING_LETTERS if self.castlingRights & right) or "-"
+        enpassant = "-" if self.enpassantPossible == () else Move.colsToFiles[self.enpassantPossible[1]] + Move.rowsToRanks[self.enpassantPossible[0]]
+        return " ".join(("/".join(ranks), "w" if self.whiteToMove else "b", castling, enpassant,
+                         str(self.halfmoveClock), str(self.fullmoveNumber)))
 
     '''
-    Takes a move as a parameter and executes it. This will not work for castling, en passant and pawn promotion
+    Takes a move as a parameter and executes it, castling, en passant and promotion included
     '''
     def makeMove(self, move):
+        stack = self.undoStack
+        i = len(self.moveLog) * UNDO_FIELDS
+        if i == len(stack):
+            stack.extend([None] * len(stack))
+        stack[i + UNDO_ENPASSANT] = self.enpassantPossible
+        stack[i + UNDO_CASTLING] = self.castlingRights
+        stack[i + UNDO_HALFMOVE] = self.halfmoveClock
+        stack[i + UNDO_HASH] = self.hash
+        stack[i + UNDO_PAWN_HASH] = self.pawnHash
+        stack[i + UNDO_MG] = self.mgScore
+        stack[i + UNDO_EG] = self.egScore
+        stack[i + UNDO_PHASE] = self.phase
         self.board[move.startRow][move.startCol] = "--"
         self.board[move.endRow][move.endCol] = move.pieceMoved
         self.moveLog.append(move) # log the move so we can undo it later
-        turn = "W: " if self.whiteToMove else "B: "
-        print(turn + move.pieceMoved[1]+move.getRankFile(move.endRow, move.endCol))
+        self.halfmoveClock = 0 if move.pieceMoved[1] == "P" or move.pieceCaptured != "--" else self.halfmoveClock + 1
+        if not self.whiteToMove:
+            self.fullmoveNumber += 1
+        if self.logger is not None:
+            turn = "W: " if self.whiteToMove else "B: "
+            self.logger(turn + move.pieceMoved[1]+move.getRankFile(move.endRow, move.endCol))
         self.whiteToMove = not self.whiteToMove # swap players
         # update king's position if needed
         if move.pieceMoved == "wK":
@@ -52,10 +172,10 @@ class GameState():
         elif move.pieceMoved == "bK":
             self.blackKingLocation = (move.endRow, move.endCol)
 
-        # pawn promotion
+        # pawn promotion, the piece to promote to is part of the move
         if move.isPawnPromotion:
-            move.promotionChoice = move.getPromotionChoice()
-            print(move.pieceMoved[1] + move.getRankFile(move.endRow,move.endCol) + " is now " + move.promotionChoice + move.getRankFile(move.endRow, move.endCol))
+            if self.logger is not None:
+                self.logger(move.pieceMoved[1] + move.getRankFile(move.endRow,move.endCol) + " is now " + move.promotionChoice + move.getRankFile(move.endRow, move.endCol))
             self.board[move.endRow][move.endCol] = move.pieceMoved[0] + move.promotionChoice
 
 
@@ -63,11 +183,33 @@ class GameState():
         if move.isEnpassantMove:
             self.board[move.startRow][move.endCol] = '--'  # capturing the pawn
 
+        # castle move, the rook jumps over the king
+        if move.isCastleMove:
+            rookFrom, rookTo = ChessBitboard.CASTLE_ROOK_MOVES[move.endRow * 8 + move.endCol]
+            self.board[rookTo // 8][rookTo % 8] = self.board[rookFrom // 8][rookFrom % 8]
+            self.board[rookFrom // 8][rookFrom % 8] = "--"
+        # update castling rights, a king or rook leaving its square or a rook being captured on it loses them
+        castlingRights = self.castlingRights
+        self.castlingRights &= ChessBitboard.CASTLING_MASKS[move.startRow * 8 + move.startCol] & \
+                               ChessBitboard.CASTLING_MASKS[move.endRow * 8 + move.endCol]
+        self.hash ^= ChessZobrist.CASTLING_KEYS[castlingRights] ^ ChessZobrist.CASTLING_KEYS[self.castlingRights]
+
+        if self.bitboards is not None:
+            self.bitboards.makeMove(move, self.board[move.endRow][move.endCol])
+        self.hash ^= ChessZobrist.moveKey(move, self.board[move.endRow][move.endCol]) ^ ChessZobrist.SIDE_KEY ^ \
+                     ChessZobrist.enpassantKey(self.enpassantPossible)
+        self.pawnHash ^= ChessZobrist.pawnMoveKey(move, self.board[move.endRow][move.endCol])
+        mg, eg, phase = ChessEvaluation.moveDelta(move, self.board[move.endRow][move.endCol])
+        self.mgScore += mg
+        self.egScore += eg
+        self.phase += phase
+
         # update enpassantPossible variable
         if move.pieceMoved[1] == "P" and abs(move.startRow - move.endRow) == 2:   # only on 2 square pawn advances
             self.enpassantPossible = ((move.startRow+move.endRow)//2, move.startCol)
         else:
             self.enpassantPossible = ()
+        self.hash ^= ChessZobrist.enpassantKey(self.enpassantPossible)
 
 
     '''
@@ -75,11 +217,32 @@ class GameState():
     '''
     def undoMove(self):
         if len(self.moveLog) != 0:
-            print(self.moveLog[len(self.moveLog)-1].pieceMoved[1]+self.moveLog[len(self.moveLog)-1].getRankFile(self.moveLog[len(self.moveLog)-1].endRow, self.moveLog[len(self.moveLog)-1].endCol)+" undone")
             move = self.moveLog.pop()
-            self.board[move.startRow][move.startCol] = move.pieceMoved
+            if self.logger is not None:
+                self.logger(move.pieceMoved[1] + move.getRankFile(move.endRow, move.endCol) + " undone")
+            if self.bitboards is not None:
+                self.bitboards.undoMove(move, self.board[move.endRow][move.endCol])
+            # put back the state saved by makeMove, rather than working it out again
+            stack = self.undoStack
+            i = len(self.moveLog) * UNDO_FIELDS
+            self.enpassantPossible = stack[i + UNDO_ENPASSANT]
+            self.castlingRights = stack[i + UNDO_CASTLING]
+            self.halfmoveClock = stack[i + UNDO_HALFMOVE]
+            self.hash = stack[i + UNDO_HASH]
+            self.pawnHash = stack[i + UNDO_PAWN_HASH]
+            self.mgScore = stack[i + UNDO_MG]
+            self.egScore = stack[i + UNDO_EG]
+            self.phase = stack[i + UNDO_PHASE]
+            self.board[move.startRow][move.startCol] = move.pieceMoved   # the pawn again if the move promoted
             self.board[move.endRow][move.endCol] = move.pieceCaptured
             self.whiteToMove = not self.whiteToMove  # switch turns back
+            if not self.whiteToMove:
+                self.fullmoveNumber -= 1
+            # undo castle move
+            if move.isCastleMove:
+                rookFrom, rookTo = ChessBitboard.CASTLE_ROOK_MOVES[move.endRow * 8 + move.endCol]
+                self.board[rookFrom // 8][rookFrom % 8] = self.board[rookTo // 8][rookTo % 8]
+                self.board[rookTo // 8][rookTo % 8] = "--"
             # update king's position if needed
             if move.pieceMoved == "wK":
                 self.whiteKingLocation = (move.startRow, move.startCol)
@@ -89,16 +252,15 @@ class GameState():
             if move.isEnpassantMove:
                 self.board[move.endRow][move.endCol] = '--' #leave landing square blank
                 self.board[move.startRow][move.endCol] = move.pieceCaptured
-                print(move.pieceCaptured)
-                self.enpassantPossible = (move.endRow, move.endCol)
-            #undo a 2 square pawn advance
-            if move.pieceMoved[1] == "P" and abs(move.startRow - move.endRow) == 2:
-                self.enpassantPossible = ()
+                if self.logger is not None:
+                    self.logger(move.pieceCaptured)
 
     '''
     All moves considering checks
     '''
     def getValidMoves(self):
+        if self.bitboards is not None:
+            return self.getBitboardValidMoves()
         moves = []
         self.inCheck, self.pins, self.checks = self.checkForPinsAndChecks()
         if self.whiteToMove:
@@ -125,11 +287,11 @@ class GameState():
                         validSquares.append(validSquare)
                         if validSquare[0] == checkRow and validSquare[1] == checkCol:  # once you get to piece and checks
                             break
-                # get rid of any moves that don't block check or move king
-                for i in range(len(moves) -1, -1, -1):
-                    if moves[i].pieceMoved[1] != 'K':  # move doesn't move king so it must block or capture
-                        if not (moves[i].endRow, moves[i].endCol) in validSquares:
-                            moves.remove(moves[i])
+                # get rid of any moves that don't block check or move king, in one pass rather than removing one at a time
+                # en passant captures the checker on the square behind the landing square
+                validSquares = set(validSquares)
+                moves = [m for m in moves if m.pieceMoved[1] == 'K' or
+                         ((m.startRow, m.endCol) if m.isEnpassantMove else (m.endRow, m.endCol)) in validSquares]
 
             else:  # double check, king has to move
                 self.getKingMoves(kingRow, kingCol, moves)
@@ -137,6 +299,91 @@ class GameState():
             moves = self.getAllPossibleMoves()
         return moves
 
+    '''
+    All moves considering checks, generated from the bitboard backend
+    '''
+    def getBitboardValidMoves(self):
+        enpassantSq = self.enpassantPossible[0]*8 + self.enpassantPossible[1] if self.enpassantPossible != () else None
+        codes, self.inCheck = self.bitboards.generateMoves(self.whiteToMove, enpassantSq, self.castlingRights)
+        return [Move.fromCode(code, self.board) for code in codes]
+
+    '''
+    Staged pseudo-legal move generation: yields the captures and promotions as one list, then the quiet moves as another.
+    The moves may leave the king in check, so make each one and test moveLeftKingInCheck before using it.
+    A caller that stops after the captures never pays for generating the quiet moves on the bitboard backend.
+    '''
+    def generatePseudoLegalMoves(self):
+        if self.bitboards is not None:
+            enpassantSq = self.enpassantPossible[0]*8 + self.enpassantPossible[1] if self.enpassantPossible != () else None
+            for captures in (True, False):
+                yield [Move.fromCode(code, self.board) for code in self.bitboards.generatePseudoLegalMoves(self.whiteToMove, enpassantSq, captures, self.castlingRights)]
+        else:
+            self.pins = []  # no pin filtering, legality is checked when the move is made
+            moves = self.getAllPossibleMoves()
+            yield [m for m in moves if m.pieceCaptured != "--" or m.isPawnPromotion]
+            yield [m for m in moves if m.pieceCaptured == "--" and not m.isPawnPromotion]
+
+    '''
+    Pseudo-legal captures, en passant captures and promotions only, for the quiescence search. The legacy backend
+    finds them from the enemy pieces' attackers rather than generating every move and throwing the quiet ones away.
+    '''
+    def generateCaptures(self):
+        if self.bitboards is not None:
+            return next(self.generatePseudoLegalMoves())
+        us, them = ("w", "b") if self.whiteToMove else ("b", "w")
+        moves = []
+        for row in range(8):
+            for col in range(8):
+                if self.board[row][col][0] == them:
+                    for sq in self.attackersOf(row, col, us):
+                        if self.board[sq // 8][sq % 8][1] == "P":
+                            self.addPawnMoves((sq // 8, sq % 8), (row, col), moves)
+                        else:
+                            moves.append(Move((sq // 8, sq % 8), (row, col), self.board))
+        if self.enpassantPossible != ():
+            for sq in self.attackersOf(self.enpassantPossible[0], self.enpassantPossible[1], us):
+                if self.board[sq // 8][sq % 8][1] == "P":
+                    moves.append(Move((sq // 8, sq % 8), self.enpassantPossible, self.board, isEnpassantMove=True))
+        fromRow, toRow = (1, 0) if self.whiteToMove else (6, 7)     # pushes onto the last rank
+        for col in range(8):
+            if self.board[fromRow][col] == us + "P" and self.board[toRow][col] == "--":
+                self.addPawnMoves((fromRow, col), (toRow, col), moves)
+        return moves
+
+    '''
+    Returns the pseudo-legal move with this moveID in the current position, or None, generating only the moves of the piece on its start square
+    '''
+    def findPseudoLegalMove(self, moveID):
+        row, col = (moveID // 1000) % 10, (moveID // 100) % 10
+        piece = self.board[row][col]
+        if piece == "--" or (piece[0] == 'w') != self.whiteToMove:
+            return None
+        moves = []
+        self.pins = []
+        self.moveFunctions[piece[1]](row, col, moves)
+        for move in moves:
+            if move.moveID == moveID:
+                return move
+        return None
+
+    '''
+    Determine if the king of the given colour is attacked, scanning out from the king rather than generating the opponent's moves
+    '''
+    def kingAttacked(self, white):
+        if self.bitboards is not None:
+            return self.bitboards.kingAttacked("w" if white else "b")
+        whiteToMove = self.whiteToMove
+        self.whiteToMove = white
+        attacked = self.checkForPinsAndChecks()[0]
+        self.whiteToMove = whiteToMove
+        return attacked
+
+    '''
+    After makeMove: did the move just made leave its own king in check, i.e. was it illegal
+    '''
+    def moveLeftKingInCheck(self):
+        return self.kingAttacked(not self.whiteToMove)
+
 
     '''
     Determine if the current player is in check
@@ -147,10 +394,29 @@ class GameState():
         else:
             return self.squareUnderAttack(self.blackKingLocation[0], self.blackKingLocation[1])
 
+    '''
+    Bitboard (bit row*8+col) of the squares the pieces of colour attack. Both sides' maps are computed together the
+    first time one is asked for in a position and reused until the position changes.
+    '''
+    def getAttackMap(self, colour):
+        if self.attackMapsHash != self.hash:
+            bitboards = self.bitboards if self.bitboards is not None else ChessBitboard.Bitboards(self.board)
+            self.attackMaps = {"w": bitboards.attackMap("w"), "b": bitboards.attackMap("b")}
+            self.attackMapsHash = self.hash
+        return self.attackMaps[colour]
+
     '''
     Determine if the enemy can attack the square r,c
     '''
     def squareUnderAttack(self, row, col):
+        return (self.getAttackMap("b" if self.whiteToMove else "w") >> (row * 8 + col)) & 1 == 1
+
+    '''
+    squareUnderAttack by generating all the enemy's moves, much slower. Only kept as a reference to check the attack
+    maps against (ChessPerft --verify-attacks). The two agree on our king's square, which is all the move generator
+    asks of it; see ChessPerft.checkAttacks for the squares where they differ.
+    '''
+    def squareUnderAttackByMoves(self, row, col):
         self.whiteToMove = not self.whiteToMove  # switch to opponent's turn
         oppMoves = self.getAllPossibleMoves()
         self.whiteToMove = not self.whiteToMove  # switch turn back
@@ -187,41 +453,56 @@ class GameState():
 
         if self.whiteToMove:                                            # white pawn moves
             if self.board[row-1][col] == "--":                          # 1 square pawn advance
-                if not piecePinned or pinDirection == (-1, 0):
-                    moves.append(Move((row, col), (row-1, col), self.board))
+                if not piecePinned or pinDirection in ((-1, 0), (1, 0)):
+                    self.addPawnMoves((row, col), (row-1, col), moves)
                     if row == 6 and self.board[row-2][col] == "--":     # 2 square pawn advance
                         moves.append(Move((row, col), (row-2, col), self.board))
             if col-1 >= 0:                                              # captures to the left
                 if self.board[row-1][col-1][0] != self.board[row][col][0] and self.board[row-1][col-1][0] != "-":
                     if not piecePinned or pinDirection == (-1, -1):
-                        moves.append(Move((row, col), (row-1, col-1), self.board))
+                        self.addPawnMoves((row, col), (row-1, col-1), moves)
                 elif (row-1, col-1) == self.enpassantPossible:
-                    moves.append(Move((row, col), (row-1, col-1), self.board, isEnpassantMove=True))
+                    if (not piecePinned or pinDirection == (-1, -1)) and not self.enpassantExposesKing(row, col, col-1):
+                        moves.append(Move((row, col), (row-1, col-1), self.board, isEnpassantMove=True))
             if col+1 < len(self.board[0]):                              # captures to the right
                 if self.board[row-1][col+1][0] != self.board[row][col][0] and self.board[row-1][col+1][0] != "-":
                     if not piecePinned or pinDirection == (-1, +1):
-                        moves.append(Move((row, col), (row-1, col+1), self.board))
+                        self.addPawnMoves((row, col), (row-1, col+1), moves)
                 elif (row-1, col+1) == self.enpassantPossible:
-                    moves.append(Move((row, col), (row-1, col+1), self.board, isEnpassantMove=True))
+                    if (not piecePinned or pinDirection == (-1, +1)) and not self.enpassantExposesKing(row, col, col+1):
+                        moves.append(Move((row, col), (row-1, col+1), self.board, isEnpassantMove=True))
 
         else:                                                           # black pawn moves
             if self.board[row+1][col] == "--":                          # 1 square pawn advance
-                if not piecePinned or pinDirection == (1, 0):
-                    moves.append(Move((row, col), (row+1, col), self.board))
+                if not piecePinned or pinDirection in ((-1, 0), (1, 0)):
+                    self.addPawnMoves((row, col), (row+1, col), moves)
                     if row == 1 and self.board[row+2][col] == "--":     # 2 square pawn advance
                         moves.append(Move((row, col), (row+2, col), self.board))
             if col-1 >= 0:                                              # captures to the left
                 if self.board[row+1][col-1][0] != self.board[row][col][0] and self.board[row+1][col-1][0] != "-":
                     if not piecePinned or pinDirection == (1, -1):
-                        moves.append(Move((row, col), (row+1, col-1), self.board))
+                        self.addPawnMoves((row, col), (row+1, col-1), moves)
                 elif (row+1, col-1) == self.enpassantPossible:
-                    moves.append(Move((row, col), (row+1, col-1), self.board, isEnpassantMove=True))
+                    if (not piecePinned or pinDirection == (1, -1)) and not self.enpassantExposesKing(row, col, col-1):
+                        moves.append(Move((row, col), (row+1, col-1), self.board, isEnpassantMove=True))
             if col+1 < len(self.board[0]):                              # captures to the right
                 if self.board[row+1][col+1][0] != self.board[row][col][0] and self.board[row+1][col+1][0] != "-":
                     if not piecePinned or pinDirection == (1, 1):
-                        moves.append(Move((row, col), (row+1, col+1), self.board))
+                        self.addPawnMoves((row, col), (row+1, col+1), moves)
                 elif (row+1, col+1) == self.enpassantPossible:
-                    moves.append(Move((row, col), (row+1, col+1), self.board, isEnpassantMove=True))
+                    if (not piecePinned or pinDirection == (1, 1)) and not self.enpassantExposesKing(row, col, col+1):
+                        moves.append(Move((row, col), (row+1, col+1), self.board, isEnpassantMove=True))
+
+
+    '''
+    Add a pawn move to the list, or one move per piece it can promote to if it reaches the last rank
+    '''
+    def addPawnMoves(self, startSq, endSq, moves):
+        if endSq[0] == 0 or endSq[0] == len(self.board) - 1:
+            for choice in Move.promotionPieces:
+                moves.append(Move(startSq, endSq, self.board, promotionChoice=choice))
+        else:
+            moves.append(Move(startSq, endSq, self.board))
 
 
     '''
@@ -300,31 +581,91 @@ class GameState():
     Get all the queen moves for the queen located at row, col and add these moves to the list
     '''
     def getQueenMoves(self, row, col, moves):
-        # pass
-        self.getBishopMoves(row, col, moves)
+        # rook moves first: getRookMoves leaves a queen's pin in place so getBishopMoves still sees it
         self.getRookMoves(row, col, moves)
+        self.getBishopMoves(row, col, moves)
+
+    '''
+    Determine if an en passant capture from row, col would expose the king along its rank, as both pawns leave the rank at once
+    '''
+    def enpassantExposesKing(self, row, col, capturedCol):
+        kingRow, kingCol = self.whiteKingLocation if self.whiteToMove else self.blackKingLocation
+        if kingRow != row:
+            return False
+        enemyColour = "b" if self.whiteToMove else "w"
+        step = 1 if capturedCol > kingCol else -1   # both pawns are on the same side of the king
+        c = kingCol + step
+        while 0 <= c < len(self.board[row]):
+            if c != col and c != capturedCol and self.board[row][c] != "--":
+                return self.board[row][c][0] == enemyColour and self.board[row][c][1] in ("R", "Q")
+            c += step
+        return False
 
     '''
     Get all the king moves for the king located at row, col and add these moves to the list
     '''
     def getKingMoves(self, row, col, moves):
+        enemyAttacks = self.getAttackMap("b" if self.board[row][col][0] == "w" else "w")
         for i in range(-1, 2):
             for j in range(-1, 2):
                 if abs(i) + abs(j) == 0:                            # moving to your own square is not a move
                     pass
                 elif 0 <= row + i < len(self.board) and 0 <= col + j < len(self.board[0]) and self.board[row+i][col+j][0] != self.board[row][col][0]:
-                    if self.whiteToMove:
-                        self.whiteKingLocation = (row+i, col+j)
-                    else:
-                        self.blackKingLocation = (row+i, col+j)
-                    inCheck, pins, checks = self.checkForPinsAndChecks()
-                    if not inCheck:
+                    if not (enemyAttacks >> ((row + i) * 8 + col + j)) & 1:     # the king can't move onto an attacked square
                         moves.append(Move((row,col), (row+i, col+j), self.board))
-                    # place king back on original square
-                    if self.whiteToMove:
-                        self.whiteKingLocation = (row, col)
-                    else:
-                        self.blackKingLocation = (row, col)
+        self.getCastleMoves(row, col, moves, enemyAttacks)
+
+    '''
+    Add the castling moves for the king at row, col: the right is held, the rook is home, the squares between them are
+    empty and the king doesn't start, pass or land on a square in enemyAttacks
+    '''
+    def getCastleMoves(self, row, col, moves, enemyAttacks):
+        colour = self.board[row][col][0]
+        for right, kingFrom, kingTo, rookFrom, rookTo, empty, safe in ChessBitboard.CASTLES[colour]:
+            if self.castlingRights & right and kingFrom == row * 8 + col and \
+                    self.board[rookFrom // 8][rookFrom % 8] == colour + "R" and not enemyAttacks & safe and \
+                    all(self.board[sq // 8][sq % 8] == "--" for sq in ChessBitboard.squares(empty)):
+                moves.append(Move((row, col), (kingTo // 8, kingTo % 8), self.board))
+
+    '''
+    Squares (row*8+col) of the pieces of the given colour that attack row, col, scanning out from it the same way
+    checkForPinsAndChecks does. Squares in removed count as empty, so pieces behind them are found too (x-rays).
+    '''
+    def attackersOf(self, row, col, colour, removed=()):
+        if self.bitboards is not None:
+            occupied = self.bitboards.colours["w"] | self.bitboards.colours["b"]
+            for sq in removed:
+                occupied &= ~(1 << sq)
+            return list(ChessBitboard.squares(self.bitboards.attackersOf(row * 8 + col, colour, occupied) & occupied))
+        attackers = []
+        directions = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
+        for j in range(len(directions)):
+            d = directions[j]
+            for i in range(1, len(self.board)):
+                endRow = row + d[0] * i
+                endCol = col + d[1] * i
+                if not (0 <= endRow < len(self.board) and 0 <= endCol < len(self.board)):
+                    break                                   # off board
+                endPiece = self.board[endRow][endCol]
+                if endPiece == "--" or endRow * 8 + endCol in removed:
+                    continue
+                if endPiece[0] == colour:
+                    type = endPiece[1]
+                    if (0 <= j <= 3 and type == 'R') or \
+                            (4 <= j <= 7 and type == 'B') or \
+                            (i == 1 and type == 'P' and ((colour == 'w' and 6 <= j <= 7) or (colour == 'b' and 4 <= j <= 5))) or \
+                            (type == 'Q') or \
+                            (i == 1 and type == 'K'):
+                        attackers.append(endRow * 8 + endCol)
+                break                                       # the first piece in the way blocks the rest
+        knightMoves = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+        for m in knightMoves:
+            endRow = row + m[0]
+            endCol = col + m[1]
+            if 0 <= endRow < len(self.board) and 0 <= endCol < len(self.board) and \
+                    self.board[endRow][endCol] == colour + "N" and endRow * 8 + endCol not in removed:
+                attackers.append(endRow * 8 + endCol)
+        return attackers
 
     '''
     Returns if the player is in check, a list of pins and a list of checks
@@ -400,6 +741,9 @@ class GameState():
 This class is responsible for handling all the information relating to a single move
 '''
 class Move():
+    # moves are created by the thousand during move generation, so no per-instance __dict__
+    __slots__ = ("startRow", "startCol", "endRow", "endCol", "pieceMoved", "pieceCaptured",
+                 "isPawnPromotion", "promotionChoice", "isEnpassantMove", "isCastleMove", "moveID")
     # maps keys to values
     # key : value
     ranksToRows = {"1": 7, "2": 6, "3": 5, "4": 4,
@@ -408,8 +752,10 @@ class Move():
     filesToCols = {"a": 0, "b": 1, "c": 2, "d": 3,
                    "e": 4, "f": 5, "g": 6, "h": 7}
     colsToFiles = {v: k for k, v in filesToCols.items()}
+    promotionPieces = ("Q", "R", "B", "N")
+    promotionIDs = {"Q": 0, "R": 10000, "B": 20000, "N": 30000}   # keeps the four promotions of one pawn move apart
 
-    def __init__(self, startSq, endSq, board, isEnpassantMove=False):
+    def __init__(self, startSq, endSq, board, isEnpassantMove=False, promotionChoice="Q"):
         self.startRow = startSq[0]
         self.startCol = startSq[1]
         self.endRow = endSq[0]
@@ -417,14 +763,28 @@ class Move():
         self.pieceMoved = board[self.startRow][self.startCol]
         self.pieceCaptured = board[self.endRow][self.endCol]
         # pawn promotion info
-        self.isPawnPromotion = False
-        self.promotionChoice = "Q"
+        self.promotionChoice = promotionChoice
         self.isPawnPromotion = ((self.pieceMoved == "wP" and self.endRow == 0) or (self.pieceMoved == "bP" and self.endRow == 7))
         # enpassant info
         self.isEnpassantMove = isEnpassantMove
         if self.isEnpassantMove:
             self.pieceCaptured = "wP" if self.pieceMoved == "bP" else "bP"
+        # castle info, a king moving two squares is always castling
+        self.isCastleMove = self.pieceMoved[1] == "K" and abs(self.endCol - self.startCol) == 2
         self.moveID = self.startRow*1000 + self.startCol*100 + self.endRow*10 + self.endCol
+        if self.isPawnPromotion:
+            self.moveID += self.promotionIDs[promotionChoice]
+
+    '''
+    Build a Move from a packed int produced by the bitboard generator
+    '''
+    @classmethod
+    def fromCode(cls, code, board):
+        start = code & 63
+        end = (code >> 6) & 63
+        promotion = code >> ChessBitboard.PROMOTION_SHIFT
+        return cls((start >> 3, start & 7), (end >> 3, end & 7), board, code & ChessBitboard.ENPASSANT_FLAG != 0,
+                   cls.promotionPieces[promotion - 1] if promotion else "Q")
 
 
     '''
@@ -435,6 +795,9 @@ class Move():
             return self.moveID == other.moveID
         return False
 
+    def __hash__(self):
+        return self.moveID
+
 
     def getChessNotation(self):
         return self.getRankFile(self.startRow, self.startCol) + " -> " + self.getRankFile(self.endRow, self.endCol)
@@ -443,12 +806,20 @@ class Move():
     def getRankFile(self, row, col):
         return self.colsToFiles[col] + self.rowsToRanks[row]
 
+    '''
+    Long algebraic notation as used by UCI, e.g. e2e4 or a7a8q
+    '''
+    def getUciNotation(self):
+        notation = self.getRankFile(self.startRow, self.startCol) + self.getRankFile(self.endRow, self.endCol)
+        return notation + self.promotionChoice.lower() if self.isPawnPromotion else notation
 
+
+    '''
+    Ask on the console which piece to promote to. Only the pygame front end does this, the engine never blocks on input
+    '''
     def getPromotionChoice(self):
-        self.promotionChoice = input("Pawn promotion! What piece would you like to promote to: Q, R, N or B? ")
-        if self.promotionChoice in ["Q", "R", "N", "B"]:
-            pass
-        else:
+        choice = input("Pawn promotion! What piece would you like to promote to: Q, R, N or B? ")
+        while choice not in self.promotionPieces:
             print("Please type one of Q, R, N or B (case sensitive)")
-            self.getPromotionChoice()
-        return self.promotionChoice
+            choice = input("Pawn promotion! What piece would you like to promote to: Q, R, N or B? ")
+        return choice
@@ -0,0 +1,332 @@
+"""
+Static evaluation of a GameState. Material and piece-square scores are summed separately for the middlegame and the
+endgame, and blended by the game phase (how much non-pawn material is left). GameState keeps the three totals up to
+date in makeMove and undoMove using moveDelta, so the evaluation at a leaf is a few arithmetic operations instead of
+a scan of the board. computeScores builds the same totals from scratch, to check the incremental ones against.
+Pawn structure only changes when a pawn moves or is taken, so its score is cached under GameState.pawnHash and is
+almost always a lookup. Mobility is slower and only added when asked for.
+    python -m Chess.ChessEvaluation --bench
+"""
+import argparse
+import random
+import time
+from Chess import ChessBitboard
+from Chess import ChessEngine
+
+# material in centipawns for the middlegame and the endgame
+MG_VALUES = {"P": 82, "N": 337, "B": 365, "R": 477, "Q": 1025, "K": 0}
+EG_VALUES = {"P": 94, "N": 281, "B": 297, "R": 512, "Q": 936, "K": 0}
+# how much each piece counts towards the middlegame, the start position adds up to MAX_PHASE
+PHASE_WEIGHTS = {"P": 0, "N": 1, "B": 1, "R": 2, "Q": 4, "K": 0}
+MAX_PHASE = 24
+
+# piece-square bonuses for white, laid out like the board (first row is the 8th rank). Black uses them mirrored.
+PAWN_MG = [
+      0,   0,   0,   0,   0,   0,   0,   0,
+     50,  50,  50,  50,  50,  50,  50,  50,
+     10,  10,  20,  30,  30,  20,  10,  10,
+      5,   5,  10,  25,  25,  10,   5,   5,
+      0,   0,   0,  20,  20,   0,   0,   0,
+      5,  -5, -10,   0,   0, -10,  -5,   5,
+      5,  10,  10, -20, -20,  10,  10,   5,
+      0,   0,   0,   0,   0,   0,   0,   0]
+PAWN_EG = [bonus for bonus in (0, 80, 50, 30, 15, 5, 0, 0) for _ in range(8)]   # just reward advancing
+KNIGHT = [
+    -50, -40, -30, -30, -30, -30, -40, -50,
+    -40, -20,   0,   0,   0,   0, -20, -40,
+    -30,   0,  10,  15,  15,  10,   0, -30,
+    -30,   5,  15,  20,  20,  15,   5, -30,
+    -30,   0,  15,  20,  20,  15,   0, -30,
+    -30,   5,  10,  15,  15,  10,   5, -30,
+    -40, -20,   0,   5,   5,   0, -20, -40,
+    -50, -40, -30, -30, -30, -30, -40, -50]
+BISHOP = [
+    -20, -10, -10, -10, -10, -10, -10, -20,
+    -10,   0,   0,   0,   0,   0,   0, -10,
+    -10,   0,   5,  10,  10,   5,   0, -10,
+    -10,   5,   5,  10,  10,   5,   5, -10,
+    -10,   0,  10,  10,  10,  10,   0, -10,
+    -10,  10,  10,  10,  10,  10,  10, -10,
+    -10,   5,   0,   0,   0,   0,   5, -10,
+    -20, -10, -10, -10, -10, -10, -10, -20]
+ROOK = [
+      0,   0,   0,   0,   0,   0,   0,   0,
+      5,  10,  10,  10,  10,  10,  10,   5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+      0,   0,   0,   5,   5,   0,   0,   0]
+QUEEN = [
+    -20, -10, -10,  -5,  -5, -10, -10, -20,
+    -10,   0,   0,   0,   0,   0,   0, -10,
+    -10,   0,   5,   5,   5,   5,   0, -10,
+     -5,   0,   5,   5,   5,   5,   0,  -5,
+      0,   0,   5,   5,   5,   5,   0,  -5,
+    -10,   5,   5,   5,   5,   5,   0, -10,
+    -10,   0,   5,   0,   0,   0,   0, -10,
+    -20, -10, -10,  -5,  -5, -10, -10, -20]
+KING_MG = [
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -20, -30, -30, -40, -40, -30, -30, -20,
+    -10, -20, -20, -20, -20, -20, -20, -10,
+     20,  20,   0,   0,   0,   0,  20,  20,
+     20,  30,  10,   0,   0,  10,  30,  20]
+KING_EG = [
+    -50, -40, -30, -20, -20, -30, -40, -50,
+    -30, -20, -10,   0,   0, -10, -20, -30,
+    -30, -10,  20,  30,  30,  20, -10, -30,
+    -30, -10,  30,  40,  40,  30, -10, -30,
+    -30, -10,  30,  40,  40,  30, -10, -30,
+    -30, -10,  20,  30,  30,  20, -10, -30,
+    -30, -30,   0,   0,   0,   0, -30, -30,
+    -50, -30, -30, -30, -30, -30, -30, -50]
+MG_BONUSES = {"P": PAWN_MG, "N": KNIGHT, "B": BISHOP, "R": ROOK, "Q": QUEEN, "K": KING_MG}
+EG_BONUSES = {"P": PAWN_EG, "N": KNIGHT, "B": BISHOP, "R": ROOK, "Q": QUEEN, "K": KING_EG}
+
+# pawn structure, cached in PAWN_CACHE
+DOUBLED_PAWN = -10      # for each pawn beyond the first on a file
+ISOLATED_PAWN = -15     # no friendly pawn on either neighbouring file
+PASSED_PAWN = (0, 5, 10, 20, 35, 60, 100, 0)    # by ranks advanced from the starting rank
+PAWN_CACHE_ENTRIES = 16384
+# mobility, added by evaluate(gs, full=True)
+MOBILITY = {"N": 4, "B": 3, "R": 2, "Q": 1}     # per square attacked that isn't our own piece
+
+
+'''
+Material plus square bonus for every (piece, square), from white's point of view (black's entries are negative)
+'''
+def pieceSquareTables(values, bonuses):
+    tables = {}
+    for piece in ChessBitboard.PIECES:
+        sign = 1 if piece[0] == "w" else -1
+        table = bonuses[piece[1]]
+        tables[piece] = [sign * (values[piece[1]] + table[sq if piece[0] == "w" else sq ^ 56]) for sq in range(64)]
+    return tables
+
+
+MG_TABLES = pieceSquareTables(MG_VALUES, MG_BONUSES)
+EG_TABLES = pieceSquareTables(EG_VALUES, EG_BONUSES)
+
+
+'''
+Change to (middlegame, endgame, phase) made by a move, placedPiece being what ended up on the landing square.
+Undoing the move takes away the same amounts.
+'''
+def moveDelta(move, placedPiece):
+    start = move.startRow * 8 + move.startCol
+    end = move.endRow * 8 + move.endCol
+    mg = MG_TABLES[placedPiece][end] - MG_TABLES[move.pieceMoved][start]
+    eg = EG_TABLES[placedPiece][end] - EG_TABLES[move.pieceMoved][start]
+    phase = PHASE_WEIGHTS[placedPiece[1]] - PHASE_WEIGHTS[move.pieceMoved[1]]
+    if move.pieceCaptured != "--":
+        captured = move.startRow * 8 + move.endCol if move.isEnpassantMove else end
+        mg -= MG_TABLES[move.pieceCaptured][captured]
+        eg -= EG_TABLES[move.pieceCaptured][captured]
+        phase -= PHASE_WEIGHTS[move.pieceCaptured[1]]
+    if move.isCastleMove:
+        rook = move.pieceMoved[0] + "R"
+        rookFrom, rookTo = ChessBitboard.CASTLE_ROOK_MOVES[end]
+        mg += MG_TABLES[rook][rookTo] - MG_TABLES[rook][rookFrom]
+        eg += EG_TABLES[rook][rookTo] - EG_TABLES[rook][rookFrom]
+    return mg, eg, phase
+
+
+'''
+(middlegame, endgame, phase) totals for a GameState from scratch
+'''
+def computeScores(gs):
+    mg = eg = phase = 0
+    for row in range(8):
+        for col in range(8):
+            piece = gs.board[row][col]
+            if piece != "--":
+                mg += MG_TABLES[piece][row * 8 + col]
+                eg += EG_TABLES[piece][row * 8 + col]
+                phase += PHASE_WEIGHTS[piece[1]]
+    return mg, eg, phase
+
+
+'''
+Blend the middlegame and endgame scores by the phase, from white's point of view
+'''
+def taper(mg, eg, phase):
+    phase = min(phase, MAX_PHASE)   # promotions can take it past the start position's
+    return (mg * phase + eg * (MAX_PHASE - phase)) // MAX_PHASE
+
+
+'''
+Doubled, isolated and passed pawns, from white's point of view
+'''
+def pawnStructure(board):
+    files = {"w": [0] * 8, "b": [0] * 8}
+    pawns = []
+    for row in range(8):
+        for col in range(8):
+            if board[row][col][1] == "P":
+                files[board[row][col][0]][col] += 1
+                pawns.append((board[row][col][0], row, col))
+    score = 0
+    for colour, sign in (("w", 1), ("b", -1)):
+        for col in range(8):
+            if files[colour][col] > 1:
+                score += sign * DOUBLED_PAWN * (files[colour][col] - 1)
+    for colour, row, col in pawns:
+        sign = 1 if colour == "w" else -1
+        if (col == 0 or files[colour][col - 1] == 0) and (col == 7 or files[colour][col + 1] == 0):
+            score += sign * ISOLATED_PAWN
+        enemy = "b" if colour == "w" else "w"
+        ahead = range(row - 1, 0, -1) if colour == "w" else range(row + 1, 7)
+        if not any(board[r][c] == enemy + "P" for r in ahead for c in range(max(col - 1, 0), min(col + 2, 8))):
+            score += sign * PASSED_PAWN[6 - row if colour == "w" else row - 1]
+    return score
+
+
+'''
+This class is a fixed-size cache of pawn structure scores keyed by the pawn hash. Each key has one slot, a newer
+position simply replaces whatever was there.
+'''
+class PawnCache():
+    def __init__(self, entries=PAWN_CACHE_ENTRIES):
+        self.mask = entries - 1     # entries is a power of two
+        self.keys = [-1] * entries  # -1 never matches a 64-bit key
+        self.scores = [0] * entries
+        self.hits = 0
+        self.misses = 0
+
+    '''
+    Pawn structure score of gs, computed and stored only if its pawn hash isn't in the cache
+    '''
+    def probe(self, gs):
+        i = gs.pawnHash & self.mask
+        if self.keys[i] == gs.pawnHash:
+            self.hits += 1
+            return self.scores[i]
+        self.misses += 1
+        score = pawnStructure(gs.board)
+        self.keys[i] = gs.pawnHash
+        self.scores[i] = score
+        return score
+
+    def clear(self):
+        self.keys = [-1] * len(self.keys)
+        self.hits = self.misses = 0
+
+    def getStats(self):
+        probes = self.hits + self.misses
+        return {"entries": len(self.keys), "hits": self.hits, "misses": self.misses,
+                "hitRate": self.hits / probes if probes else 0.0}
+
+
+PAWN_CACHE = PawnCache()    # one per process
+
+
+'''
+Squares attacked by the knights, bishops, rooks and queens of each side, weighted, from white's point of view
+'''
+def mobility(gs):
+    bitboards = gs.bitboards if gs.bitboards is not None else ChessBitboard.Bitboards(gs.board)
+    occupied = bitboards.colours["w"] | bitboards.colours["b"]
+    score = 0
+    for colour, sign in (("w", 1), ("b", -1)):
+        own = bitboards.colours[colour]
+        for pieceType, weight in MOBILITY.items():
+            for sq in ChessBitboard.squares(bitboards.pieces[colour + pieceType]):
+                attacks = 0
+                if pieceType == "N":
+                    attacks = ChessBitboard.KNIGHT_ATTACKS[sq]
+                if pieceType in ("R", "Q"):
+                    attacks |= ChessBitboard.rookAttacks(sq, occupied)
+                if pieceType in ("B", "Q"):
+                    attacks |= ChessBitboard.bishopAttacks(sq, occupied)
+                score += sign * weight * bin(attacks & ~own).count("1")
+    return score
+
+
+'''
+Score of the position in centipawns from the point of view of the side to move, using the incrementally kept totals
+and the pawn cache. full adds the mobility term, which costs a scan of the board.
+'''
+def evaluate(gs, full=False):
+    score = taper(gs.mgScore, gs.egScore, gs.phase) + PAWN_CACHE.probe(gs)
+    if full:
+        score += mobility(gs)
+    return score if gs.whiteToMove else -score
+
+
+'''
+Same as evaluate but with everything recomputed from the board, for checking the incremental totals and the cache
+'''
+def evaluateFromScratch(gs, full=False):
+    score = taper(*computeScores(gs)) + pawnStructure(gs.board)
+    if full:
+        score += mobility(gs)
+    return score if gs.whiteToMove else -score
+
+
+'''
+GameStates reached by random play from the start position, with the moves that led there still on the move log
+'''
+def randomPositions(count, seed=1, useBitboards=False):
+    rng = random.Random(seed)
+    positions = []
+    while len(positions) < count:
+        gs = ChessEngine.GameState(useBitboards)
+        for _ in range(rng.randrange(10, 80)):
+            moves = gs.getValidMoves()
+            if not moves:
+                break
+            gs.makeMove(rng.choice(moves))
+        positions.append(gs)
+    return positions
+
+
+def timed(evaluator, positions, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for gs in positions:
+            evaluator(gs)
+    elapsed = time.perf_counter() - start
+    return len(positions) * repeats / elapsed if elapsed > 0 else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check and benchmark the static evaluation")
+    parser.add_argument("--positions", type=int, default=200, help="random positions to use")
+    parser.add_argument("--repeats", type=int, default=20, help="times to evaluate each position in the benchmark")
+    parser.add_argument("--bench", action="store_true", help="report evaluations per second")
+    args = parser.parse_args()
+
+    positions = randomPositions(args.positions)
+    # the incremental totals must match a recount at every position along the way, both ways through the move log
+    checked = 0
+    for gs in positions:
+        moves = []
+        while True:
+            if (gs.mgScore, gs.egScore, gs.phase) != computeScores(gs) or evaluate(gs) != evaluateFromScratch(gs):
+                raise AssertionError("incremental evaluation out of step after " +
+                                     ", ".join(m.getChessNotation() for m in gs.moveLog))
+            checked += 1
+            if not gs.moveLog:
+                break
+            moves.append(gs.moveLog[-1])
+            gs.undoMove()
+        for move in reversed(moves):
+            gs.makeMove(move)
+    print(f"incremental evaluation matches a recount in {checked} positions")
+
+    if args.bench:
+        PAWN_CACHE.clear()
+        print(f"incremental:  {timed(evaluate, positions, args.repeats):,.0f} evaluations/s")
+        stats = PAWN_CACHE.getStats()
+        print(f"pawn cache hits {stats['hits']} misses {stats['misses']} hit rate {stats['hitRate']:.1%}")
+        print(f"from scratch: {timed(evaluateFromScratch, positions, args.repeats):,.0f} evaluations/s")
+        print(f"full:         {timed(lambda gs: evaluate(gs, True), positions, max(args.repeats // 10, 1)):,.0f} evaluations/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,27 @@
 """
 This will be our main driver file. It will be responsible for handling our user input and displaying the current GameState
+Legal move generation and the engine's search run in a worker process, so the window keeps responding while the engine
+thinks. The UI sends it requests on one queue and reads answers, and the search's progress, from another. The board
+is redrawn only where squares changed, from a pre-rendered surface of the empty board, and when there's nothing to
+wait for the loop sleeps until the next input event.
+    python -m Chess.ChessMain                           # two players at one board
+    python -m Chess.ChessMain --engine black --time 3   # play white against the engine
 """
+import argparse
+import multiprocessing
+import pickle
+import queue
 import pygame
 import pygame as p
 from Chess import ChessEngine
+from Chess import ChessSearch
 
 p.init()
 WIDTH = HEIGHT = 512    # 400 is another option
 DIMENSION = 8           # dimensions of a chessboard are 8x8
 SQ_SIZE = HEIGHT // DIMENSION
-MAX_FPS = 15            # for animations later on
+STATUS_HEIGHT = 24      # strip under the board for whose turn it is and the engine's progress
+MAX_FPS = 15            # how often to look for answers from the worker while waiting on it
 IMAGES = {}
 
 
@@ -23,100 +35,257 @@ def loadImages():
     # Note: we can access an image by saying 'IMAGES['wP']'
 
 
+'''
+Body of the worker process. Requests are (kind, requestID, pickled GameState, seconds to search), kind being "moves"
+or "search", or None to quit. Answers are tagged with the requestID so the UI can drop ones it no longer wants.
+Requests with an ID below firstWanted were cancelled while queued and are skipped without doing any work.
+'''
+def engineWorker(requests, responses, stopSignal, firstWanted):
+    searcher = ChessSearch.Searcher()
+    searcher.stopSignal = stopSignal
+    searcher.checkEvery = 64    # so an undo or quit stops the search promptly
+    while True:
+        request = requests.get()
+        if request is None:
+            return
+        kind, requestID, snapshot, maxTime = request
+        if requestID < firstWanted.value:
+            continue
+        gs = pickle.loads(snapshot)
+        if kind == "moves":
+            moves = gs.getValidMoves()
+            responses.put(("moves", requestID, moves, gs.inCheck))
+        else:
+            stopSignal.clear()
+            if requestID < firstWanted.value:   # cancelled just now, after the stop signal was set for it
+                continue
+            def progress(result):
+                responses.put(("info", requestID, result.depth, result.nodesPerSecond(), result.score))
+            result = searcher.search(gs, maxTime, onIteration=progress)
+            responses.put(("bestmove", requestID, result.bestMove, result.depth, result.score))
+
+
+'''
+This class is the UI's side of the worker process
+'''
+class EngineWorker():
+    def __init__(self):
+        self.requests = multiprocessing.Queue()
+        self.responses = multiprocessing.Queue()
+        self.stopSignal = multiprocessing.Event()
+        self.firstWanted = multiprocessing.Value("q", 0)    # lower request IDs have been cancelled
+        self.process = multiprocessing.Process(target=engineWorker, daemon=True,
+                                               args=(self.requests, self.responses, self.stopSignal, self.firstWanted))
+        self.process.start()
+        self.lastID = 0
+        self.pending = set()    # requests still waiting for an answer
+
+    def request(self, kind, gs, maxTime=None):
+        self.lastID += 1
+        logger = gs.logger
+        gs.logger = None    # the worker gets a silent copy
+        try:
+            snapshot = pickle.dumps(gs)
+        finally:
+            gs.logger = logger
+        self.requests.put((kind, self.lastID, snapshot, maxTime))
+        self.pending.add(self.lastID)
+        return self.lastID
+
+    '''
+    Forget every outstanding request: stop a search in progress and have the worker skip the ones still queued
+    '''
+    def cancel(self):
+        self.pending.clear()
+        self.firstWanted.value = self.lastID + 1    # before the stop signal, see engineWorker
+        self.stopSignal.set()
+
+    '''
+    Answers that have arrived for requests still wanted, without waiting
+    '''
+    def poll(self):
+        answers = []
+        while True:
+            try:
+                answer = self.responses.get_nowait()
+            except queue.Empty:
+                return answers
+            if answer[1] in self.pending:
+                if answer[0] != "info":
+                    self.pending.discard(answer[1])
+                answers.append(answer)
+
+    def close(self):
+        self.stopSignal.set()
+        self.requests.put(None)
+        self.process.join(1)
+
+
 '''
 The main driver for our code. This will handle user input and updating the graphics
 '''
 def main():
+    parser = argparse.ArgumentParser(description="Play chess in a window")
+    parser.add_argument("--engine", choices=("white", "black"), help="side for the engine to play")
+    parser.add_argument("--time", type=float, default=2.0, help="seconds the engine thinks per move")
+    args = parser.parse_args()
+    engineWhite = None if args.engine is None else args.engine == "white"
+
     p.init()
-    screen = p.display.set_mode((WIDTH, HEIGHT))
-    clock = p.time.Clock()
-    screen.fill(p.Color("white"))
-    gs = ChessEngine.GameState()
-    validMoves = gs.getValidMoves()
-    moveMade = False        # flag variable for when a move is made
+    screen = p.display.set_mode((WIDTH, HEIGHT + STATUS_HEIGHT))
+    # everything is allowed to start with, so block it all first: mouse motion and the like needn't wake us
+    p.event.set_blocked(None)
+    p.event.set_allowed([p.QUIT, p.MOUSEBUTTONDOWN, p.KEYDOWN, p.VIDEOEXPOSE])
+    font = p.font.SysFont("arial", STATUS_HEIGHT - 8)
     loadImages()            # only do this once, before the while loop
+    boardSurface = renderBoard()
+    shown = [[None] * DIMENSION for _ in range(DIMENSION)]  # what each square on screen shows, (piece, highlighted)
+    shownStatus = None
+    gs = ChessEngine.GameState()
+    gs.logger = print       # report moves on the console
+    worker = EngineWorker()
+    validMoves = []
+    worker.request("moves", gs)
+    status = "white to move"
     running = True
     sqSelected = ()         # no square is selected, keep track of the last click of the user (tuple: (row, col))
     playerClicks = []       # keep track of player clicks (two tuples: [(6, 4), (4, 4)])
-    while running:
-        for e in p.event.get():
-            if e.type == p.QUIT:
-                running = False
-
-            # mouse handler
-            elif e.type == p.MOUSEBUTTONDOWN:
-                location = p.mouse.get_pos()            # (x,y) location of the mouse
-                col = location[0]//SQ_SIZE
-                row = location[1]//SQ_SIZE
-                if sqSelected == (row, col):            # the user clicked the same square twice
-                    sqSelected = ()                     # deselect
-                    playerClicks = []                   # clear player clicks
-                else:
-                    sqSelected = (row, col)
-                    playerClicks.append(sqSelected)     # append for both first and second clicks
-                if len(playerClicks) == 2:              # after 2nd click
-                    if gs.board[playerClicks[0][0]][playerClicks[0][1]] == "--" or gs.board[playerClicks[0][0]][playerClicks[0][1]][0] == gs.board[playerClicks[1][0]][playerClicks[1][1]][0]:  # if the player clicks one piece then another on their side, select piece 2
-                        sqSelected = playerClicks[1]
-                        playerClicks = [playerClicks[1]]
-                        break
-                    move = ChessEngine.Move(playerClicks[0], playerClicks[1], gs.board)
-                    for i in range(len(validMoves)):
-                        if move == validMoves[i]:
-                            gs.makeMove(validMoves[i])
-                            moveMade = True
-                            sqSelected = ()                     # reset userClicks
-                            playerClicks = []
-                    if not moveMade:
-                        playerClicks = [sqSelected]
-
-            # key handler
-            elif e.type == p.KEYDOWN:
-                if e.key == p.K_z:  # undo when z is pressed
-                    gs.undoMove()
+    try:
+        while running:
+            moveMade = False        # flag variable for when a move is made
+            # sleep until there's input, or until it's time to look for answers if the worker is busy
+            events = [p.event.wait(1000 // MAX_FPS if worker.pending else 0)] + p.event.get()
+            for e in events:
+                if e.type == p.QUIT:
+                    running = False
+
+                # the window was uncovered, so repaint all of it
+                elif e.type == p.VIDEOEXPOSE:
+                    shown = [[None] * DIMENSION for _ in range(DIMENSION)]
+                    shownStatus = None
+
+                # mouse handler, ignored while the engine is to move
+                elif e.type == p.MOUSEBUTTONDOWN and gs.whiteToMove != engineWhite:
+                    location = p.mouse.get_pos()            # (x,y) location of the mouse
+                    col = location[0]//SQ_SIZE
+                    row = location[1]//SQ_SIZE
+                    if row >= DIMENSION:                    # the status strip
+                        continue
+                    if sqSelected == (row, col):            # the user clicked the same square twice
+                        sqSelected = ()                     # deselect
+                        playerClicks = []                   # clear player clicks
+                    else:
+                        sqSelected = (row, col)
+                        playerClicks.append(sqSelected)     # append for both first and second clicks
+                    if len(playerClicks) == 2:              # after 2nd click
+                        if gs.board[playerClicks[0][0]][playerClicks[0][1]] == "--" or gs.board[playerClicks[0][0]][playerClicks[0][1]][0] == gs.board[playerClicks[1][0]][playerClicks[1][1]][0]:  # if the player clicks one piece then another on their side, select piece 2
+                            sqSelected = playerClicks[1]
+                            playerClicks = [playerClicks[1]]
+                            continue
+                        move = ChessEngine.Move(playerClicks[0], playerClicks[1], gs.board)
+                        if move.isPawnPromotion and move in validMoves:    # the promotion piece is part of the move, so ask before matching
+                            move = ChessEngine.Move(playerClicks[0], playerClicks[1], gs.board, promotionChoice=move.getPromotionChoice())
+                        for i in range(len(validMoves)):
+                            if move == validMoves[i]:
+                                gs.makeMove(validMoves[i])
+                                moveMade = True
+                                sqSelected = ()                     # reset userClicks
+                                playerClicks = []
+                                break
+                        if not moveMade:
+                            playerClicks = [sqSelected]
+
+                # key handler
+                elif e.type == p.KEYDOWN:
+                    if e.key == p.K_z and gs.moveLog:  # undo when z is pressed
+                        gs.undoMove()
+                        if gs.whiteToMove == engineWhite and gs.moveLog:    # take back the engine's reply as well
+                            gs.undoMove()
+                        moveMade = True
+
+            for answer in worker.poll():
+                if answer[0] == "moves":
+                    validMoves, inCheck = answer[2], answer[3]
+                    side = "white" if gs.whiteToMove else "black"
+                    if not validMoves:
+                        status = "checkmate" if inCheck else "stalemate"
+                    elif gs.whiteToMove == engineWhite:
+                        worker.request("search", gs, args.time)
+                        status = "engine thinking"
+                    else:
+                        status = side + " to move" + (", in check" if inCheck else "")
+                elif answer[0] == "info":
+                    status = f"engine thinking: depth {answer[2]}, {answer[3]:,.0f} nodes/s, score {answer[4]}"
+                elif answer[2] is not None:     # bestmove: ("bestmove", requestID, move, depth, score)
+                    gs.makeMove(answer[2])
                     moveMade = True
+                    sqSelected = ()
+                    playerClicks = []
 
-        if moveMade:
-            validMoves = gs.getValidMoves()
-            moveMade = False
+            if moveMade:
+                worker.cancel()     # anything asked about the old position is out of date
+                validMoves = []
+                worker.request("moves", gs)
+                # until the moves arrive, which is when the engine is asked to think if it's its turn
+                status = "engine thinking" if gs.whiteToMove == engineWhite else \
+                    ("white" if gs.whiteToMove else "black") + " to move"
 
-        drawGameState(screen, gs, sqSelected)
-        clock.tick(MAX_FPS)
-        p.display.flip()
+            rects = drawGameState(screen, gs, sqSelected, boardSurface, shown)
+            if status != shownStatus:
+                rects.append(drawStatus(screen, font, status))
+                shownStatus = status
+            if rects:
+                p.display.update(rects)
+    finally:
+        worker.close()
 
 
 '''
-Responsible for all the graphics within a current game state
+Draw the squares that changed since the last frame, returning their rects for the display update
 '''
-def drawGameState(screen, gs, sqSelected):
-    drawBoard(screen, sqSelected)   # draw squares on the board
-    # add in piece highlighting or move suggestions (later)
-    drawPieces(screen, gs.board) # draw pieces on top of those squares
+def drawGameState(screen, gs, sqSelected, boardSurface, shown):
+    rects = []
+    for row in range(DIMENSION):
+        for column in range(DIMENSION):
+            state = (gs.board[row][column], (row, column) == sqSelected)
+            if shown[row][column] != state:
+                rects.append(drawSquare(screen, boardSurface, row, column, state[0], state[1]))
+                shown[row][column] = state
+    return rects
 
 
 '''
-Draw the squares on the board.
+The empty board, drawn once and copied from square by square afterwards
 '''
-def drawBoard(screen, sqSelected):
+def renderBoard():
     colors = [p.Color("white"), p.Color("gray")]
+    surface = p.Surface((WIDTH, HEIGHT)).convert()
     for row in range(DIMENSION):
         for column in range(DIMENSION):
-            if (row, column) == sqSelected:
-                p.draw.rect(screen, p.Color("red"), pygame.Rect(column*SQ_SIZE, row*SQ_SIZE, SQ_SIZE, SQ_SIZE))
-            else:
-                p.draw.rect(screen, colors[(row + column)%2], pygame.Rect(column*SQ_SIZE, row*SQ_SIZE, SQ_SIZE, SQ_SIZE))
+            p.draw.rect(surface, colors[(row + column)%2], pygame.Rect(column*SQ_SIZE, row*SQ_SIZE, SQ_SIZE, SQ_SIZE))
+    return surface
 
 
 '''
-Draw the pieces on the board using the current game state's board variable
+Draw one square and the piece on it, if there is one
 '''
-def drawPieces(screen, board):
-    for row in range(DIMENSION):
-        for column in range(DIMENSION):
-            piece = board[row][column]
-            if piece != "--": # not empty square
-                screen.blit(IMAGES[piece], p.Rect(column*SQ_SIZE, row*SQ_SIZE, SQ_SIZE, SQ_SIZE))
+def drawSquare(screen, boardSurface, row, column, piece, selected):
+    rect = p.Rect(column*SQ_SIZE, row*SQ_SIZE, SQ_SIZE, SQ_SIZE)
+    if selected:
+        p.draw.rect(screen, p.Color("red"), rect)
+    else:
+        screen.blit(boardSurface, rect, rect)
+    if piece != "--": # not empty square
+        screen.blit(IMAGES[piece], rect)
+    return rect
+
+
+def drawStatus(screen, font, text):
+    rect = p.Rect(0, HEIGHT, WIDTH, STATUS_HEIGHT)
+    p.draw.rect(screen, p.Color("black"), rect)
+    screen.blit(font.render(text, True, p.Color("white")), (4, HEIGHT + 4))
+    return rect
 
 
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,150 @@
+"""
+Parallel search over several processes with Lazy SMP. Every worker searches the same position on its own copy of the
+GameState, and they all share one transposition table in shared memory, so each worker's results prune the others'
+trees. Worker 0 runs in the calling process and its answer is the one returned; the helpers stop when it finishes.
+Processes rather than threads, since the GIL would keep threads running this pure Python search on one core.
+    python -m Chess.ChessParallel --workers 8 --time 10
+    python -m Chess.ChessParallel --bench --workers 8 --depth 5
+"""
+import argparse
+import multiprocessing
+import pickle
+from Chess import ChessEngine
+from Chess import ChessSearch
+from Chess import ChessTransposition
+
+# fixed positions for the time-to-depth benchmark
+BENCH_FENS = [
+    ChessEngine.START_FEN,
+    "r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R w KQkq - 2 3",
+    "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+    "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+]
+
+
+'''
+Body of a helper process: search each position it is sent until it is sent None
+'''
+def helperLoop(index, buffer, tasks, results, stopSignal):
+    searcher = ChessSearch.Searcher(tt=ChessTransposition.TranspositionTable(buffer=buffer))
+    searcher.stopSignal = stopSignal
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        snapshot, maxTime, maxNodes, maxDepth, generation = task
+        searcher.tt.generation = generation
+        # odd helpers run one ply ahead so the workers don't all search the same tree in step
+        result = searcher.search(pickle.loads(snapshot), maxTime, maxNodes, maxDepth, depthOffset=index % 2, newSearch=False)
+        results.put(workerStats(index, result))
+
+
+def workerStats(index, result):
+    return {"worker": index, "depth": result.depth, "nodes": result.nodes, "elapsed": result.elapsed,
+            "nps": result.nodesPerSecond()}
+
+
+'''
+This class runs a Lazy SMP search. The helper processes are started once and reused for every search, call close()
+to shut them down.
+'''
+class ParallelSearcher():
+    def __init__(self, workers=2, hashMb=64):
+        self.buffer = multiprocessing.RawArray("Q", ChessTransposition.tableBytes(hashMb) // 8)
+        self.tt = ChessTransposition.TranspositionTable(buffer=self.buffer)
+        self.stopSignal = multiprocessing.Event()   # set to stop every worker, e.g. on a UCI stop command
+        self.searcher = ChessSearch.Searcher(tt=self.tt)
+        self.searcher.stopSignal = self.stopSignal
+        self.results = multiprocessing.Queue()
+        self.helpers = []
+        for index in range(1, workers):
+            tasks = multiprocessing.Queue()
+            process = multiprocessing.Process(target=helperLoop, args=(index, self.buffer, tasks, self.results, self.stopSignal),
+                                              daemon=True)
+            process.start()
+            self.helpers.append((process, tasks))
+
+    '''
+    Same budget and result as Searcher.search. result.workers holds each worker's depth, nodes and nodes per second.
+    '''
+    def search(self, gs, maxTime=None, maxNodes=None, maxDepth=ChessSearch.MAX_PLY - 1, onIteration=None):
+        self.stopSignal.clear()
+        self.tt.newSearch()
+        logger = gs.logger
+        gs.logger = None    # the helpers get a silent copy; the callback may not pickle anyway
+        try:
+            snapshot = pickle.dumps(gs)
+        finally:
+            gs.logger = logger
+        for process, tasks in self.helpers:
+            tasks.put((snapshot, maxTime, maxNodes, maxDepth, self.tt.generation))
+        result = self.searcher.search(gs, maxTime, maxNodes, maxDepth, onIteration, newSearch=False)
+        self.stopSignal.set()
+        result.workers = [workerStats(0, result)] + sorted((self.results.get() for _ in self.helpers),
+                                                            key=lambda stats: stats["worker"])
+        return result
+
+    def close(self):
+        for process, tasks in self.helpers:
+            tasks.put(None)
+        for process, tasks in self.helpers:
+            process.join()
+        self.helpers = []
+
+
+def printWorkers(result):
+    totalNodes = sum(stats["nodes"] for stats in result.workers)
+    for stats in result.workers:
+        print(f"  worker {stats['worker']}: depth {stats['depth']} nodes {stats['nodes']} nps {stats['nps']:,.0f}")
+    print(f"  total: nodes {totalNodes} nps {totalNodes / result.elapsed if result.elapsed > 0 else 0:,.0f}")
+
+
+'''
+Time to reach depth on each benchmark position with 1 worker and with the given number, and the speedup between them
+'''
+def benchmark(workers, depth, hashMb):
+    times = {}
+    for count in sorted({1, workers}):
+        searcher = ParallelSearcher(count, hashMb)
+        try:
+            times[count] = 0.0
+            for fen in BENCH_FENS:
+                searcher.tt.clear()
+                result = searcher.search(ChessEngine.GameState.fromFen(fen), maxDepth=depth)
+                times[count] += result.elapsed
+                print(f"workers {count} depth {result.depth} in {result.elapsed:.2f}s: {fen}")
+                printWorkers(result)
+        finally:
+            searcher.close()
+    print(f"time to depth {depth}: 1 worker {times[1]:.2f}s, {workers} workers {times[workers]:.2f}s, "
+          f"speedup {times[1] / times[workers]:.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search a position on several processes")
+    parser.add_argument("--fen", default=ChessEngine.START_FEN)
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--time", type=float, default=5.0, help="seconds to search")
+    parser.add_argument("--depth", type=int, help="depth limit (default: none, or 5 for --bench)")
+    parser.add_argument("--hash", type=int, default=64, help="shared transposition table size in MB")
+    parser.add_argument("--bench", action="store_true", help="measure time to --depth on the benchmark positions")
+    args = parser.parse_args()
+
+    if args.bench:
+        benchmark(args.workers, args.depth or 5, args.hash)
+        return
+    def printIteration(result):
+        print(f"depth {result.depth} score {result.score} nodes {result.nodes} pv {result.getPvNotation()}")
+
+    searcher = ParallelSearcher(args.workers, args.hash)
+    try:
+        result = searcher.search(ChessEngine.GameState.fromFen(args.fen), args.time, maxDepth=args.depth or ChessSearch.MAX_PLY - 1,
+                                 onIteration=printIteration)
+    finally:
+        searcher.close()
+    printWorkers(result)
+    print("bestmove " + (result.bestMove.getUciNotation() if result.bestMove is not None else "(none)"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+"""
+Headless perft tool for the move generator. It counts the leaf nodes of the move tree to a given depth using
+GameState.makeMove, undoMove and getValidMoves, reports nodes per second and can break the count down per root move.
+Run with --suite to check the counts against the published reference values, e.g.
+    python -m Chess.ChessPerft --suite
+    python -m Chess.ChessPerft --suite --depth 3 --verify-attacks
+    python -m Chess.ChessPerft --verify-fen     # FEN export/import round trip over the suite and random games from it
+    python -m Chess.ChessPerft --fen "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - -" --depth 4 --divide
+"""
+import argparse
+import random
+import time
+from Chess import ChessEngine
+from Chess import ChessZobrist
+
+# standard test positions with their reference node counts for depth 1, 2, 3, ...
+# (see https://www.chessprogramming.org/Perft_Results)
+SUITE = [
+    {"name": "start", "fen": ChessEngine.START_FEN, "depth": 4, "nodes": [20, 400, 8902, 197281, 4865609]},
+    {"name": "kiwipete", "fen": "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1", "depth": 3,
+     "nodes": [48, 2039, 97862, 4085603]},
+    {"name": "position3", "fen": "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1", "depth": 5,
+     "nodes": [14, 191, 2812, 43238, 674624, 11030083]},
+    {"name": "position4", "fen": "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1", "depth": 3,
+     "nodes": [6, 264, 9467, 422333]},
+    {"name": "position5", "fen": "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8", "depth": 3,
+     "nodes": [44, 1486, 62379, 2103487]},
+    {"name": "position6", "fen": "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10", "depth": 3,
+     "nodes": [46, 2079, 89890, 3894594]},
+    {"name": "promotions", "fen": "n1n5/PPPk4/8/8/8/8/4Kppp/5N1N b - - 0 1", "depth": 4,
+     "nodes": [24, 496, 9483, 182838, 3605103]},
+]
+PLAYOUTS = 20           # random games played from each suite position by --verify-fen
+PLAYOUT_PLIES = 80      # longest of those games
+
+
+'''
+Check the incremental Zobrist and pawn hashes against ones computed from scratch
+'''
+def checkHash(gs):
+    if gs.hash != ChessZobrist.computeHash(gs) or gs.pawnHash != ChessZobrist.computePawnHash(gs):
+        raise AssertionError("incremental hash out of step after " + ", ".join(m.getChessNotation() for m in gs.moveLog))
+
+
+'''
+Check the attack-map squareUnderAttack against squareUnderAttackByMoves on the side to move's king, the square the
+two have to agree on. Elsewhere they differ on purpose: the map counts the enemy's own pieces it defends, pawn
+diagonals onto empty squares and squares the enemy king covers even where we defend them, and sees through our king,
+so the king can't step back along a slider's line. Moves also reach castling squares, which the map doesn't.
+'''
+def checkAttacks(gs):
+    row, col = gs.whiteKingLocation if gs.whiteToMove else gs.blackKingLocation
+    if gs.squareUnderAttack(row, col) != gs.squareUnderAttackByMoves(row, col):
+        raise AssertionError("attack map disagrees with move generation on the king after " +
+                             ", ".join(m.getChessNotation() for m in gs.moveLog))
+
+
+'''
+Check that the position's FEN loads back into the same position: the same FEN again, the same hashes and the same
+legal moves, so castling rights and the en passant square survive the trip as well as the board.
+'''
+def checkFen(gs):
+    exported = gs.toFen()
+    reloaded = ChessEngine.GameState.fromFen(exported, gs.bitboards is not None)
+    if reloaded.toFen() != exported or reloaded.hash != gs.hash or reloaded.pawnHash != gs.pawnHash or \
+            sorted(m.getUciNotation() for m in reloaded.getValidMoves()) != \
+            sorted(m.getUciNotation() for m in gs.getValidMoves()):
+        raise AssertionError("FEN round trip changed " + exported + " after " +
+                             ", ".join(m.getChessNotation() for m in gs.moveLog))
+
+
+'''
+FEN round trip over every suite position, which must export exactly as written, and the positions of PLAYOUTS random
+games from each. Returns the number of positions checked; a mismatch raises AssertionError.
+'''
+def runFenRoundTrip(useBitboards=False, seed=0):
+    rng = random.Random(seed)
+    checked = 0
+    for entry in SUITE:
+        gs = ChessEngine.GameState.fromFen(entry["fen"], useBitboards)
+        if gs.toFen() != entry["fen"]:
+            raise AssertionError(f"{entry['name']} exports as {gs.toFen()}")
+        for _ in range(PLAYOUTS):
+            for _ in range(PLAYOUT_PLIES):
+                checkFen(gs)
+                checked += 1
+                moves = gs.getValidMoves()
+                if not moves:
+                    break
+                gs.makeMove(rng.choice(moves))
+            while gs.moveLog:
+                gs.undoMove()
+        print(f"{entry['name']}: FEN round trip ok")
+    return checked
+
+
+'''
+Count the leaf nodes of the move tree below the current position to the given depth.
+With verifyHash every node's incremental Zobrist hashes are checked against ones computed from scratch, and with
+verifyAttacks its attack map against move generation.
+'''
+def perft(gs, depth, verifyHash=False, verifyAttacks=False):
+    if verifyHash:
+        checkHash(gs)
+    if verifyAttacks:
+        checkAttacks(gs)
+    if depth == 0:
+        return 1
+    moves = gs.getValidMoves()
+    if depth == 1 and not (verifyHash or verifyAttacks):
+        return len(moves)   # bulk count, the leaves don't need to be made
+    nodes = 0
+    for move in moves:
+        gs.makeMove(move)
+        nodes += perft(gs, depth - 1, verifyHash, verifyAttacks)
+        gs.undoMove()
+    return nodes
+
+
+'''
+Perft through the staged pseudo-legal generator, checking each move's legality after making it as the search does
+'''
+def perftPseudoLegal(gs, depth, verifyHash=False, verifyAttacks=False):
+    if verifyHash:
+        checkHash(gs)
+    if verifyAttacks:
+        checkAttacks(gs)
+    if depth == 0:
+        return 1
+    nodes = 0
+    for stage in gs.generatePseudoLegalMoves():
+        for move in stage:
+            gs.makeMove(move)
+            if not gs.moveLeftKingInCheck():
+                nodes += perftPseudoLegal(gs, depth - 1, verifyHash, verifyAttacks)
+            gs.undoMove()
+    return nodes
+
+
+'''
+Perft broken down per root move, returns a dictionary of e.g. "e2e4": nodes
+'''
+def divide(gs, depth, verifyHash=False, verifyAttacks=False):
+    counts = {}
+    for move in gs.getValidMoves():
+        gs.makeMove(move)
+        counts[move.getUciNotation()] = perft(gs, depth - 1, verifyHash, verifyAttacks)
+        gs.undoMove()
+    return counts
+
+
+'''
+Run fn(*args), returning its result and the time it took
+'''
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def report(label, nodes, elapsed):
+    nps = nodes / elapsed if elapsed > 0 else 0
+    print(f"{label}: {nodes} nodes in {elapsed:.3f}s ({nps:,.0f} nodes/s)")
+
+
+'''
+Run every suite position to its depth (or maxDepth) and compare against the reference counts, returns True if all match
+'''
+def runSuite(useBitboards=False, maxDepth=None, verifyHash=False, count=perft, verifyAttacks=False):
+    allPassed = True
+    totalNodes = 0
+    totalTime = 0.0
+    for entry in SUITE:
+        depth = min(entry["depth"], maxDepth) if maxDepth else entry["depth"]
+        for d in range(1, depth + 1):
+            nodes, elapsed = timed(count, ChessEngine.GameState.fromFen(entry["fen"], useBitboards), d, verifyHash,
+                                   verifyAttacks)
+            totalNodes += nodes
+            totalTime += elapsed
+            expected = entry["nodes"][d - 1]
+            status = "ok" if nodes == expected else f"FAIL (expected {expected})"
+            report(f"{entry['name']} depth {d} {status}", nodes, elapsed)
+            if nodes != expected:
+                allPassed = False
+                break
+    report("total", totalNodes, totalTime)
+    return allPassed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Count move-tree leaf nodes to check and benchmark the move generator")
+    parser.add_argument("--fen", default=ChessEngine.START_FEN, help="position to search from (default: the start position)")
+    parser.add_argument("--depth", type=int, help="search depth (default: 3, or each suite position's own depth)")
+    parser.add_argument("--divide", action="store_true", help="break the count down per root move")
+    parser.add_argument("--suite", action="store_true", help="check the standard positions against reference counts")
+    parser.add_argument("--bitboards", action="store_true", help="use the bitboard backend")
+    parser.add_argument("--verify-hash", action="store_true", help="check the incremental hash at every node (slow)")
+    parser.add_argument("--verify-attacks", action="store_true",
+                        help="check the attack map against move generation at every node (slow)")
+    parser.add_argument("--verify-fen", action="store_true",
+                        help="check FEN export and import over the suite positions and random games from them")
+    parser.add_argument("--pseudo-legal", action="store_true", help="count through the staged pseudo-legal generator")
+    args = parser.parse_args()
+
+    count = perftPseudoLegal if args.pseudo_legal else perft
+    if args.verify_fen:
+        checked, elapsed = timed(runFenRoundTrip, args.bitboards)
+        print(f"{checked} positions round tripped in {elapsed:.3f}s")
+        return
+    if args.suite:
+        raise SystemExit(0 if runSuite(args.bitboards, args.depth, args.verify_hash, count, args.verify_attacks) else 1)
+    depth = args.depth or 3
+    gs = ChessEngine.GameState.fromFen(args.fen, args.bitboards)
+    if args.divide:
+        counts, elapsed = timed(divide, gs, depth, args.verify_hash, args.verify_attacks)
+        for notation in sorted(counts):
+            print(f"{notation}: {counts[notation]}")
+        report(f"depth {depth}", sum(counts.values()), elapsed)
+    else:
+        nodes, elapsed = timed(count, gs, depth, args.verify_hash, args.verify_attacks)
+        report(f"depth {depth}", nodes, elapsed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+"""
+Reading games from PGN files. readGames parses a stream lazily, one game at a time, into its tag pairs and the SAN
+moves of the main line (comments, variations, move numbers and NAGs are dropped). replayGame plays the moves out on a
+GameState, resolving each SAN token to the legal Move it names.
+sanToMove only looks at the pieces of the named type that reach the destination square, found by scanning out from
+it, and only makes the candidates to test that they're legal, rather than generating every legal move.
+Run as a script it replays whole archives on a pool of worker processes, reading the file as it goes (optionally
+memory-mapped) and writing one JSON line per game in input order: its validity, length and final position, or the
+FEN or hash after every move.
+    python -m Chess.ChessPgn games.pgn --workers 8 > results.jsonl
+    python -m Chess.ChessPgn games.pgn --mode hashes --mmap > hashes.jsonl
+"""
+import argparse
+import json
+import mmap
+import multiprocessing
+import os
+import re
+import sys
+import time
+from Chess import ChessBatch
+from Chess import ChessEngine
+
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+TAG_PATTERN = re.compile(r'\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+# a token of movetext: comment, line comment, variation bracket, NAG, move number or anything else up to whitespace
+TOKEN_PATTERN = re.compile(r'\{[^}]*\}?|;[^\n]*|[()]|\$\d+|\d+\.(?:\.\.)?|[^\s{}();]+')
+SAN_PATTERN = re.compile(r'^([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQ]))?$')
+# how each piece type gets to a square: (offsets, slides)
+PIECE_PATHS = {"N": (((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)), False),
+               "K": (((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)), False),
+               "R": (((-1, 0), (0, -1), (1, 0), (0, 1)), True),
+               "B": (((-1, -1), (-1, 1), (1, -1), (1, 1)), True),
+               "Q": (((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)), True)}
+
+
+class PgnError(ValueError):
+    pass
+
+
+'''
+Yields (tags, sanMoves) for each game in a text stream, e.g. an open file, reading it one line at a time
+'''
+def readGames(stream):
+    for tags, movetext in readRawGames(stream):
+        yield tags, parseMovetext(movetext)
+
+
+'''
+Yields (tags, movetext) for each game in a stream of lines, leaving the movetext unparsed, so that can be done by
+whoever replays the game
+'''
+def readRawGames(stream):
+    tags = {}
+    movetext = []
+    for line in stream:
+        line = line.strip()
+        if line.startswith("["):
+            if movetext:    # tags with no blank line after the last game's moves start a new game
+                yield tags, " ".join(movetext)
+                tags, movetext = {}, []
+            match = TAG_PATTERN.match(line)
+            if match:
+                tags[match.group(1)] = match.group(2).replace('\\"', '"').replace("\\\\", "\\")
+        elif line and not line.startswith("%"):
+            movetext.append(line)
+            if line.split()[-1] in RESULTS:     # the game termination marker ends the game
+                yield tags, " ".join(movetext)
+                tags, movetext = {}, []
+    if tags or movetext:
+        yield tags, " ".join(movetext)
+
+
+'''
+The lines of a file read through a memory map, so the OS pages the file in as it's read rather than copying it into
+buffers
+'''
+def mappedLines(path):
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:   # an empty file can't be mapped
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            for line in iter(mapped.readline, b""):
+                yield line.decode("utf-8", "replace")
+
+
+'''
+The SAN moves of the main line of a game's movetext
+'''
+def parseMovetext(text):
+    moves = []
+    depth = 0   # how deep inside variations we are
+    for token in TOKEN_PATTERN.findall(text):
+        if token == "(":
+            depth += 1
+        elif token == ")":
+            depth = max(depth - 1, 0)
+        elif depth == 0 and token[0] not in "{;$" and not token.endswith(".") and token not in RESULTS:
+            moves.append(token.rstrip("+#!?"))
+    return moves
+
+
+'''
+The legal Move in gs that a SAN token such as "Nbd7", "exd6", "e8=Q" or "O-O" names. Raises PgnError if there isn't
+exactly one.
+'''
+def sanToMove(gs, san):
+    san = san.replace("0", "O")
+    us = "w" if gs.whiteToMove else "b"
+    if san in ("O-O", "O-O-O"):
+        row = 7 if gs.whiteToMove else 0
+        moves = []
+        if gs.board[row][4] == us + "K":
+            gs.getCastleMoves(row, 4, moves, gs.getAttackMap("b" if gs.whiteToMove else "w"))
+        candidates = [move for move in moves if move.endCol == (6 if san == "O-O" else 2)]
+        if len(candidates) != 1:
+            raise PgnError("illegal move " + san + " in " + gs.toFen())
+        return candidates[0]
+    match = SAN_PATTERN.match(san)
+    if match is None:
+        raise PgnError("can't read SAN move " + san)
+    piece = match.group(1) or "P"
+    fromFile = ChessEngine.Move.filesToCols[match.group(2)] if match.group(2) else None
+    fromRank = ChessEngine.Move.ranksToRows[match.group(3)] if match.group(3) else None
+    row, col = ChessEngine.Move.ranksToRows[match.group(4)[1]], ChessEngine.Move.filesToCols[match.group(4)[0]]
+    promotion = match.group(5)
+    target = gs.board[row][col]
+    if target[0] == us:
+        raise PgnError("illegal move " + san + " in " + gs.toFen())
+    enpassant = False
+    back = 1 if gs.whiteToMove else -1
+    starts = []
+    if piece != "P":    # scan out from the destination the way the piece moves, for our pieces of that type
+        offsets, slides = PIECE_PATHS[piece]
+        for dRow, dCol in offsets:
+            r, c = row + dRow, col + dCol
+            while 0 <= r < 8 and 0 <= c < 8:
+                if gs.board[r][c] != "--":
+                    if gs.board[r][c] == us + piece:
+                        starts.append((r, c))
+                    break
+                if not slides:
+                    break
+                r, c = r + dRow, c + dCol
+    elif target != "--" or (row, col) == gs.enpassantPossible:
+        for c in (col - 1, col + 1):
+            if 0 <= c < 8 and 0 <= row + back < 8 and gs.board[row + back][c] == us + "P":
+                starts.append((row + back, c))
+        enpassant = target == "--"
+    else:
+        if 0 <= row + back < 8 and gs.board[row + back][col] == us + "P":
+            starts.append((row + back, col))
+        elif row == (4 if gs.whiteToMove else 3) and gs.board[row + back][col] == "--" and \
+                gs.board[row + 2 * back][col] == us + "P":
+            starts.append((row + 2 * back, col))
+    king = gs.whiteKingLocation if gs.whiteToMove else gs.blackKingLocation
+    # out of check, a move by anything but the king can only be illegal if it uncovers an attack on the king
+    safe = piece != "K" and not enpassant and not gs.attackersOf(king[0], king[1], "b" if gs.whiteToMove else "w")
+    logger = gs.logger
+    gs.logger = None    # trying the candidates isn't playing them
+    candidates = []
+    try:
+        for start in starts:
+            if (fromFile is not None and start[1] != fromFile) or (fromRank is not None and start[0] != fromRank):
+                continue
+            move = ChessEngine.Move(start, (row, col), gs.board, enpassant, promotion or "Q")
+            if promotion is not None and not move.isPawnPromotion:
+                continue
+            if safe and not mayBePinned(gs, king, start):
+                candidates.append(move)
+                continue
+            gs.makeMove(move)
+            legal = not gs.moveLeftKingInCheck()
+            gs.undoMove()
+            if legal:
+                candidates.append(move)
+    finally:
+        gs.logger = logger
+    if len(candidates) != 1:
+        raise PgnError(("illegal" if not candidates else "ambiguous") + " move " + san + " in " + gs.toFen())
+    return candidates[0]
+
+
+'''
+Whether the piece on start stands between the king and an enemy slider on the same line, so moving it could expose
+the king. Only a quick filter: a piece that may be pinned still has its move tried on the board.
+'''
+def mayBePinned(gs, king, start):
+    dRow, dCol = start[0] - king[0], start[1] - king[1]
+    if dRow != 0 and dCol != 0 and abs(dRow) != abs(dCol):
+        return False    # not on a line with the king
+    dRow, dCol = (dRow > 0) - (dRow < 0), (dCol > 0) - (dCol < 0)
+    enemy = "b" if gs.whiteToMove else "w"
+    sliders = ("R", "Q") if dRow == 0 or dCol == 0 else ("B", "Q")
+    r, c = king[0] + dRow, king[1] + dCol
+    passed = False
+    while 0 <= r < 8 and 0 <= c < 8:
+        if (r, c) == start:
+            passed = True
+        elif gs.board[r][c] != "--":
+            return passed and gs.board[r][c][0] == enemy and gs.board[r][c][1] in sliders
+        r, c = r + dRow, c + dCol
+    return False
+
+
+'''
+sanToMove by generating every legal move and picking the one the SAN describes, much slower. Only kept as a reference
+to check sanToMove against.
+'''
+def sanToMoveByGeneration(gs, san):
+    san = san.replace("0", "O")
+    if san in ("O-O", "O-O-O"):
+        row = 7 if gs.whiteToMove else 0
+        piece, fromFile, fromRank, endSq, promotion = "K", 4, row, (row, 6 if san == "O-O" else 2), None
+    else:
+        match = SAN_PATTERN.match(san)
+        if match is None:
+            raise PgnError("can't read SAN move " + san)
+        piece = match.group(1) or "P"
+        fromFile = ChessEngine.Move.filesToCols[match.group(2)] if match.group(2) else None
+        fromRank = ChessEngine.Move.ranksToRows[match.group(3)] if match.group(3) else None
+        endSq = (ChessEngine.Move.ranksToRows[match.group(4)[1]], ChessEngine.Move.filesToCols[match.group(4)[0]])
+        promotion = match.group(5)
+    candidates = [move for move in gs.getValidMoves()
+                  if move.pieceMoved[1] == piece and (move.endRow, move.endCol) == endSq and
+                  (fromFile is None or move.startCol == fromFile) and (fromRank is None or move.startRow == fromRank) and
+                  (not move.isPawnPromotion or move.promotionChoice == (promotion or "Q"))]
+    if len(candidates) != 1:
+        raise PgnError(("illegal" if not candidates else "ambiguous") + " move " + san + " in " + gs.toFen())
+    return candidates[0]
+
+
+'''
+A GameState at the game's starting position, which is given by its FEN tag if it has one
+'''
+def startingPosition(tags, useBitboards=False):
+    return ChessEngine.GameState(useBitboards, tags.get("FEN"))
+
+
+'''
+Plays a game's moves out from its starting position, yielding the GameState before each move together with the move.
+The same GameState is yielded each time, so look at it before asking for the next move.
+'''
+def replayGame(tags, sanMoves, useBitboards=False):
+    gs = startingPosition(tags, useBitboards)
+    for san in sanMoves:
+        move = sanToMove(gs, san)
+        yield gs, move
+        gs.makeMove(move)
+
+
+'''
+Replay one game from its raw movetext, returning a JSON-ready dictionary. mode "result" gives the game's length and
+final position, "fens" and "hashes" also the position after every move (the start position first).
+'''
+def replayRecord(number, tags, movetext, mode="result", useBitboards=False):
+    record = {"game": number, "white": tags.get("White"), "black": tags.get("Black"), "result": tags.get("Result")}
+    sequence = []
+    plies = 0
+    try:
+        sanMoves = parseMovetext(movetext)
+        gs = startingPosition(tags, useBitboards)
+        if mode != "result":
+            sequence.append(gs.toFen() if mode == "fens" else f"{gs.hash:016x}")
+        for san in sanMoves:
+            gs.makeMove(sanToMove(gs, san))
+            plies += 1
+            if mode != "result":
+                sequence.append(gs.toFen() if mode == "fens" else f"{gs.hash:016x}")
+        record["valid"] = True
+        record["final"] = gs.toFen()
+    except ValueError as e:     # an unreadable or illegal move, or a bad FEN tag
+        record["valid"] = False
+        record["error"] = str(e)
+    record["plies"] = plies
+    if mode != "result":
+        record[mode] = sequence
+    return record
+
+
+def replayChunk(chunk, mode, useBitboards):
+    return [replayRecord(number, tags, movetext, mode, useBitboards) for number, tags, movetext in chunk]
+
+
+'''
+Replay games, given as (number, tags, movetext), on a pool of worker processes, yielding the records in input order
+(see ChessBatch.mapChunks)
+'''
+def replayGames(games, mode="result", useBitboards=False, workers=None, chunkSize=64):
+    return ChessBatch.mapChunks(replayChunk, games, (mode, useBitboards), workers, chunkSize)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay and validate PGN games in parallel, writing JSON lines")
+    parser.add_argument("files", nargs="+", help="PGN files, - for stdin")
+    parser.add_argument("--mode", choices=("result", "fens", "hashes"), default="result")
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--chunk", type=int, default=64, help="games sent to a worker at a time")
+    parser.add_argument("--mmap", action="store_true", help="read the files through a memory map")
+    parser.add_argument("--bitboards", action="store_true", help="use the bitboard backend")
+    args = parser.parse_args()
+
+    def games():
+        number = 0
+        for path in args.files:
+            if path == "-":
+                lines = sys.stdin
+            elif args.mmap:
+                lines = mappedLines(path)
+            else:
+                lines = open(path, errors="replace")
+            try:
+                for tags, movetext in readRawGames(lines):
+                    number += 1
+                    yield number, tags, movetext
+            finally:
+                if lines is not sys.stdin and not args.mmap:
+                    lines.close()
+
+    start = time.perf_counter()
+    count = invalid = plies = 0
+    for record in replayGames(games(), args.mode, args.bitboards, args.workers, args.chunk):
+        sys.stdout.write(json.dumps(record) + "\n")
+        count += 1
+        plies += record["plies"]
+        if not record["valid"]:
+            invalid += 1
+    elapsed = time.perf_counter() - start
+    sys.stderr.write(f"{count} games ({invalid} invalid), {plies} plies in {elapsed:.2f}s "
+                     f"({count / elapsed if elapsed > 0 else 0:,.1f} games/s, {plies / elapsed if elapsed > 0 else 0:,.0f} plies/s)\n")
+    sys.exit(1 if invalid else 0)
+
+
+if __name__ == "__main__":
+    main()
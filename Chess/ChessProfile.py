@@ -0,0 +1,241 @@
+"""
+Opt-in profiling of move generation and search. A Profiler wraps the move generator's stages (pin and check
+detection, each piece type's move function, pins.remove, Move construction, make/undo, the bitboard generator,
+evaluation) while it's installed and restores the original functions when it's removed, so there is no cost at all
+when profiling is off. For every stage it records the calls, the time including and excluding the stages it calls,
+and the Move objects created inside it, optionally with the bytes allocated (via tracemalloc, which is much slower).
+Searches add their node, quiescence node, cutoff and hash hit counts.
+The results export as JSON and as collapsed stacks ("outer;inner self-microseconds" per line), which flamegraph.pl,
+speedscope and inferno all read.
+    python -m Chess.ChessProfile --mode perft --depth 3 --json profile.json --folded profile.folded
+    python -m Chess.ChessProfile --mode search --time 2 --bitboards
+    flamegraph.pl profile.folded > profile.svg
+Times include the profiler's own bookkeeping, which is about as much as a small stage costs, so compare stages with
+each other rather than with unprofiled runs.
+"""
+import argparse
+import functools
+import inspect
+import json
+import time
+import tracemalloc
+from Chess import ChessBitboard
+from Chess import ChessEngine
+from Chess import ChessEvaluation
+from Chess import ChessPerft
+from Chess import ChessSearch
+
+# (owner, attribute) of everything that gets wrapped, named "Owner.attribute" in the results
+STAGES = [(ChessEngine.GameState, name) for name in (
+    "getValidMoves", "getBitboardValidMoves", "generatePseudoLegalMoves", "generateCaptures", "checkForPinsAndChecks",
+    "getAllPossibleMoves", "getPawnMoves", "getRookMoves", "getBishopMoves", "getKnightMoves", "getQueenMoves",
+    "getKingMoves", "getCastleMoves", "makeMove", "undoMove", "moveLeftKingInCheck", "squareUnderAttack",
+    "getAttackMap")] + \
+    [(ChessEngine.Move, "__init__")] + \
+    [(ChessBitboard.Bitboards, name) for name in ("generateMoves", "generatePseudoLegalMoves", "attackMap",
+                                                    "makeMove", "undoMove")] + \
+    [(ChessEvaluation, "evaluate"), (ChessSearch, "staticExchange")]
+
+
+'''
+The list of pins checkForPinsAndChecks returns while profiling, so the move functions' pins.remove calls are timed
+'''
+class PinList(list):
+    profiler = None
+
+    def remove(self, value):
+        self.profiler.enter("pins.remove")
+        try:
+            list.remove(self, value)
+        finally:
+            self.profiler.exit()
+
+
+'''
+This class collects the per-stage statistics. Use it as a context manager, or call install() and uninstall().
+GameStates keep their own references to the piece move functions, so create them once the profiler is installed, or
+pass existing ones to attach().
+'''
+class Profiler():
+    def __init__(self, memory=False):
+        self.memory = memory        # also measure bytes allocated, with tracemalloc
+        self.active = False
+        self.stats = {}             # stage: [calls, total seconds, self seconds, moves created, bytes allocated]
+        self.folded = {}            # stack of stage names: self seconds
+        self.stack = []             # [name, start time, seconds in called stages, moves at start, bytes at start]
+        self.movesCreated = 0
+        self.search = {}
+        self.originals = []
+
+    def __enter__(self):
+        self.install()
+        return self
+
+    def __exit__(self, *exc):
+        self.uninstall()
+
+    def install(self):
+        if self.active:
+            return
+        for owner, attribute in STAGES:
+            original = owner.__dict__[attribute]
+            self.originals.append((owner, attribute, original))
+            name = owner.__name__.split(".")[-1] + "." + attribute
+            if owner is ChessEngine.Move:
+                name = "Move"
+            setattr(owner, attribute, self.wrap(name, original))
+        PinList.profiler = self
+        if self.memory:
+            tracemalloc.start()
+        self.active = True
+
+    def uninstall(self):
+        if not self.active:
+            return
+        for owner, attribute, original in reversed(self.originals):
+            setattr(owner, attribute, original)
+        self.originals = []
+        if self.memory:
+            tracemalloc.stop()
+        self.active = False
+
+    '''
+    Point an existing GameState's piece move functions at the wrapped versions
+    '''
+    def attach(self, gs):
+        gs.moveFunctions = {piece: getattr(gs, function.__name__) for piece, function in gs.moveFunctions.items()}
+
+    def wrap(self, name, function):
+        profiler = self
+        if inspect.isgeneratorfunction(function):
+            # time each resumption, so the work done per stage is charged when it happens
+            @functools.wraps(function)
+            def generatorWrapper(*args, **kwargs):
+                generator = function(*args, **kwargs)
+                while True:
+                    if not profiler.active:
+                        yield from generator
+                        return
+                    profiler.enter(name)
+                    try:
+                        value = next(generator)
+                    except StopIteration:
+                        return
+                    finally:
+                        profiler.exit()
+                    yield value
+            return generatorWrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not profiler.active:     # left behind in a GameState's moveFunctions after uninstall
+                return function(*args, **kwargs)
+            if name == "Move":
+                profiler.movesCreated += 1
+            profiler.enter(name)
+            try:
+                result = function(*args, **kwargs)
+            finally:
+                profiler.exit()
+            if name == "GameState.checkForPinsAndChecks":
+                inCheck, pins, checks = result
+                result = inCheck, PinList(pins), checks
+            return result
+        return wrapper
+
+    def enter(self, name):
+        memory = tracemalloc.get_traced_memory()[0] if self.memory else 0
+        self.stack.append([name, time.perf_counter(), 0.0, self.movesCreated, memory])
+
+    def exit(self):
+        end = time.perf_counter()
+        path = tuple(frame[0] for frame in self.stack)
+        name, start, inner, moves, memory = self.stack.pop()
+        elapsed = end - start
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats[name] = [0, 0.0, 0.0, 0, 0]
+        stats[0] += 1
+        stats[1] += elapsed
+        stats[2] += elapsed - inner
+        stats[3] += self.movesCreated - moves
+        if self.memory:
+            stats[4] += max(tracemalloc.get_traced_memory()[0] - memory, 0)
+        self.folded[path] = self.folded.get(path, 0.0) + elapsed - inner
+        if self.stack:
+            self.stack[-1][2] += elapsed
+
+    '''
+    Add a finished search's counters
+    '''
+    def recordSearch(self, searcher, result):
+        stats = searcher.tt.getStats()
+        self.search = {"nodes": result.nodes, "qnodes": result.qnodes, "cutoffs": result.cutoffs,
+                       "tbHits": result.tbHits, "hashHits": stats["hits"], "hashMisses": stats["misses"],
+                       "depth": result.depth, "seconds": result.elapsed}
+
+    def toJson(self):
+        stages = {name: {"calls": calls, "totalSeconds": total, "selfSeconds": own, "movesCreated": moves}
+                  for name, (calls, total, own, moves, allocated) in self.stats.items()}
+        if self.memory:
+            for name, stats in self.stats.items():
+                stages[name]["bytesAllocated"] = stats[4]
+        return {"stages": stages, "search": self.search}
+
+    def writeJson(self, path):
+        with open(path, "w") as f:
+            json.dump(self.toJson(), f, indent=2)
+
+    '''
+    Collapsed stacks for flame graph tools, with self time in microseconds as the sample count
+    '''
+    def writeFolded(self, path):
+        with open(path, "w") as f:
+            for stack, seconds in sorted(self.folded.items()):
+                if int(seconds * 1e6) > 0:
+                    f.write(";".join(stack) + " " + str(int(seconds * 1e6)) + "\n")
+
+    def report(self):
+        lines = [f"{'stage':<40}{'calls':>12}{'total ms':>12}{'self ms':>12}{'self %':>8}{'moves':>12}" +
+                 (f"{'bytes':>14}" if self.memory else "")]
+        totalSelf = sum(stats[2] for stats in self.stats.values()) or 1.0
+        for name, (calls, total, own, moves, allocated) in sorted(self.stats.items(), key=lambda item: -item[1][2]):
+            lines.append(f"{name:<40}{calls:>12,}{total * 1e3:>12.1f}{own * 1e3:>12.1f}{own / totalSelf:>8.1%}"
+                         f"{moves:>12,}" + (f"{allocated:>14,}" if self.memory else ""))
+        if self.search:
+            lines.append(" ".join(f"{key} {value:.2f}" if isinstance(value, float) else f"{key} {value}"
+                                  for key, value in self.search.items()))
+        return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile move generation or search stage by stage")
+    parser.add_argument("--mode", choices=("perft", "search"), default="perft")
+    parser.add_argument("--fen", default=ChessEngine.START_FEN)
+    parser.add_argument("--depth", type=int, help="perft depth (default 3) or search depth limit")
+    parser.add_argument("--time", type=float, default=2.0, help="search mode: seconds to search")
+    parser.add_argument("--bitboards", action="store_true", help="use the bitboard backend")
+    parser.add_argument("--memory", action="store_true", help="also count bytes allocated per stage (slow)")
+    parser.add_argument("--json", help="write the results as JSON to this file")
+    parser.add_argument("--folded", help="write collapsed stacks for a flame graph to this file")
+    args = parser.parse_args()
+
+    profiler = Profiler(args.memory)
+    with profiler:
+        gs = ChessEngine.GameState.fromFen(args.fen, args.bitboards)
+        if args.mode == "perft":
+            nodes = ChessPerft.perft(gs, args.depth or 3)
+            print(f"perft {args.depth or 3}: {nodes} nodes")
+        else:
+            searcher = ChessSearch.Searcher()
+            result = searcher.search(gs, args.time, None, args.depth or ChessSearch.MAX_PLY - 1)
+            profiler.recordSearch(searcher, result)
+    print(profiler.report())
+    if args.json:
+        profiler.writeJson(args.json)
+    if args.folded:
+        profiler.writeFolded(args.folded)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,421 @@
+"""
+Search for the best move in a GameState. This is a negamax alpha-beta search with iterative deepening that stops on a
+wall-clock or node budget, so it answers in a fixed time rather than at a fixed depth. Moves are ordered with the
+transposition table's best move first, then captures by MVV-LVA, then killer moves, then by the history heuristic.
+Moves are generated pseudo-legally in those stages and only checked for legality when they are tried.
+At the horizon a quiescence search plays out captures and promotions until the position is quiet. The side to move
+may stand pat on the static evaluation, and captures that can't raise alpha (delta pruning) or that lose material
+by static exchange evaluation are skipped without being searched.
+With endgame tablebases loaded, positions they cover are scored exactly from them instead of being searched.
+    python -m Chess.ChessSearch --fen "r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R w KQkq - 2 3" --time 5
+    python -m Chess.ChessSearch --fen "8/8/8/4k3/8/8/8/4KR2 w - - 0 1" --tablebases tablebases
+    python -m Chess.ChessSearch --fen "8/8/5K2/3R4/2k5/2r5/8/8 w - - 0 1" --tablebases tablebases --verify-pv
+"""
+import argparse
+import time
+from Chess import ChessBook
+from Chess import ChessEngine
+from Chess import ChessEvaluation
+from Chess import ChessTablebase
+from Chess import ChessTransposition
+from Chess.ChessTransposition import EXACT, LOWER, UPPER
+
+PIECE_VALUES = {"P": 100, "N": 320, "B": 330, "R": 500, "Q": 900, "K": 0}  # for ordering captures
+MATE_SCORE = 100000
+INFINITY = 1000000
+MAX_PLY = 128
+CHECK_EVERY = 1024  # nodes between looks at the clock
+DELTA_MARGIN = 200  # a capture must be able to get within this of alpha to be worth searching in quiescence
+SEE_VALUES = dict(PIECE_VALUES, K=10000)   # the king can only take last in an exchange
+TABLEBASE_PHASE = 8     # only probe the tablebases with this little material left, e.g. queen against queen
+
+
+class SearchAborted(Exception):
+    pass
+
+
+'''
+Check that pv is a line of legal moves from the position, which is left as it was
+'''
+def checkPv(gs, pv):
+    made = 0
+    try:
+        for move in pv:
+            if move not in gs.getValidMoves():
+                raise AssertionError("illegal move " + move.getUciNotation() + " in PV " +
+                                     " ".join(m.getUciNotation() for m in pv))
+            gs.makeMove(move)
+            made += 1
+    finally:
+        for _ in range(made):
+            gs.undoMove()
+
+
+'''
+Mate scores are stored relative to the node rather than the root, so they stay right when reached by another path
+'''
+def scoreToTable(score, ply):
+    if score >= MATE_SCORE - MAX_PLY:
+        return score + ply
+    if score <= -MATE_SCORE + MAX_PLY:
+        return score - ply
+    return score
+
+
+def scoreFromTable(score, ply):
+    if score >= MATE_SCORE - MAX_PLY:
+        return score - ply
+    if score <= -MATE_SCORE + MAX_PLY:
+        return score + ply
+    return score
+
+
+'''
+Static exchange evaluation: the material the side making a capture comes out with if both sides keep recapturing on
+the landing square with their least valuable attacker, and either side may stop when carrying on would lose more
+'''
+def staticExchange(gs, move):
+    gains = [PIECE_VALUES[move.pieceCaptured[1]] if move.pieceCaptured != "--" else 0]
+    onSquare = move.pieceMoved[1]
+    if move.isPawnPromotion:
+        gains[0] += PIECE_VALUES[move.promotionChoice] - PIECE_VALUES["P"]
+        onSquare = move.promotionChoice
+    removed = {move.startRow * 8 + move.startCol}
+    if move.isEnpassantMove:
+        removed.add(move.startRow * 8 + move.endCol)
+    colour = "b" if move.pieceMoved[0] == "w" else "w"
+    while True:
+        attackers = gs.attackersOf(move.endRow, move.endCol, colour, removed)
+        if not attackers:
+            break
+        sq = min(attackers, key=lambda s: SEE_VALUES[gs.board[s // 8][s % 8][1]])
+        gains.append(SEE_VALUES[onSquare] - gains[-1])  # what the recapturing side is up if the exchange stops here
+        onSquare = gs.board[sq // 8][sq % 8][1]
+        removed.add(sq)
+        colour = "b" if colour == "w" else "w"
+    for i in range(len(gains) - 1, 0, -1):
+        gains[i - 1] = -max(-gains[i - 1], gains[i])
+    return gains[0]
+
+
+'''
+This class holds the outcome of a search: the best move, its score, the principal variation and the search statistics
+'''
+class SearchResult():
+    def __init__(self):
+        self.bestMove = None
+        self.score = 0
+        self.pv = []
+        self.depth = 0
+        self.nodes = 0
+        self.qnodes = 0             # of the nodes, how many were in the quiescence search
+        self.tbHits = 0             # positions scored from the tablebases
+        self.cutoffs = 0            # beta cutoffs in the main search
+        self.elapsed = 0.0
+        self.iterationNodes = []    # nodes searched by each completed iteration
+        self.workers = []           # per-worker statistics when the search ran in parallel
+
+    def nodesPerSecond(self):
+        return self.nodes / self.elapsed if self.elapsed > 0 else 0
+
+    '''
+    Effective branching factor: how much the tree grew between the last two completed iterations
+    '''
+    def branchingFactor(self):
+        if len(self.iterationNodes) < 2 or self.iterationNodes[-2] == 0:
+            return 0.0
+        return self.iterationNodes[-1] / self.iterationNodes[-2]
+
+    def getPvNotation(self):
+        return " ".join(m.getUciNotation() for m in self.pv)
+
+
+'''
+This class is responsible for searching a GameState. The transposition table, killer moves and history scores are
+kept between searches.
+'''
+class Searcher():
+    def __init__(self, hashMb=16, tt=None):
+        self.tt = tt if tt is not None else ChessTransposition.TranspositionTable(hashMb)
+        self.stopSignal = None  # optional event, e.g. a multiprocessing.Event, that stops the search once set
+        self.tablebases = None  # optional ChessTablebase.Tablebases to score small endgames with
+        self.checkEvery = CHECK_EVERY   # lower it to notice stopSignal sooner, e.g. for a UCI stop
+        self.killers = [[None, None] for _ in range(MAX_PLY)]
+        self.history = {}
+        self.nodes = 0
+        self.qnodes = 0
+        self.tbHits = 0
+        self.cutoffs = 0
+        self.stopTime = None
+        self.stopAt = None      # a deadline set from outside, e.g. on a UCI ponderhit, that search() doesn't reset
+        self.maxNodes = None
+        self.pvTable = [[] for _ in range(MAX_PLY + 1)]
+        self.rootPv = []
+
+    '''
+    Search gs for up to maxTime seconds, maxNodes nodes or maxDepth plies, whichever runs out first.
+    onIteration(result) is called after each completed depth. The GameState is left as it was found.
+    depthOffset shifts every iteration deeper (Lazy SMP helpers use it to spread out), and newSearch=False keeps the
+    transposition table's generation, for helpers joining a search that has already started one.
+    '''
+    def search(self, gs, maxTime=None, maxNodes=None, maxDepth=MAX_PLY - 1, onIteration=None, depthOffset=0, newSearch=True):
+        result = SearchResult()
+        start = time.perf_counter()
+        self.stopTime = start + maxTime if maxTime is not None else None
+        self.maxNodes = maxNodes
+        self.nodes = 0
+        self.qnodes = 0
+        self.tbHits = 0
+        self.cutoffs = 0
+        self.rootPv = []
+        if newSearch:
+            self.tt.newSearch()
+        logger = gs.logger
+        gs.logger = None    # don't report the moves the search tries
+        if self.tablebases is not None and gs.phase <= TABLEBASE_PHASE and self.tablebases.probe(gs) is not None:
+            maxDepth = min(maxDepth, 1 + depthOffset)   # every move is scored exactly one ply down
+        try:
+            for depth in range(1 + depthOffset, maxDepth + 1):
+                nodesBefore = self.nodes
+                try:
+                    score = self.negamax(gs, depth, 0, -INFINITY, INFINITY)
+                except SearchAborted:
+                    break
+                self.rootPv = self.pvTable[0][:]
+                result.bestMove = self.rootPv[0] if self.rootPv else None
+                result.score = score
+                result.pv = self.rootPv[:]
+                result.depth = depth
+                result.iterationNodes.append(self.nodes - nodesBefore)
+                result.nodes = self.nodes
+                result.qnodes = self.qnodes
+                result.tbHits = self.tbHits
+                result.cutoffs = self.cutoffs
+                result.elapsed = time.perf_counter() - start
+                if onIteration is not None:
+                    onIteration(result)
+                if result.bestMove is None or abs(score) >= MATE_SCORE - MAX_PLY:
+                    break   # no legal moves, or a forced mate was found
+        finally:
+            gs.logger = logger
+        result.nodes = self.nodes
+        result.qnodes = self.qnodes
+        result.tbHits = self.tbHits
+        result.cutoffs = self.cutoffs
+        result.elapsed = time.perf_counter() - start
+        if result.bestMove is None:     # stopped before depth 1 finished, fall back to any legal move
+            moves = gs.getValidMoves()
+            result.bestMove = moves[0] if moves else None
+            result.pv = moves[:1]
+        return result
+
+    def checkBudget(self):
+        if self.maxNodes is not None and self.nodes >= self.maxNodes:
+            raise SearchAborted()
+        if self.nodes % self.checkEvery == 0:
+            now = time.perf_counter()
+            if (self.stopTime is not None and now >= self.stopTime) or (self.stopAt is not None and now >= self.stopAt) or \
+                    (self.stopSignal is not None and self.stopSignal.is_set()):
+                raise SearchAborted()
+
+    '''
+    Negamax alpha-beta: returns the score of the position for the side to move, filling self.pvTable[ply]
+    '''
+    def negamax(self, gs, depth, ply, alpha, beta):
+        self.pvTable[ply] = []  # before any early return, or the parent picks up a sibling's line
+        if self.tablebases is not None and ply > 0 and gs.phase <= TABLEBASE_PHASE:
+            found = self.tablebases.probe(gs)
+            if found is not None:
+                self.tbHits += 1
+                wdl, dtm = found
+                if wdl == ChessTablebase.WIN:
+                    return MATE_SCORE - ply - dtm
+                if wdl == ChessTablebase.LOSS:
+                    return -MATE_SCORE + ply + dtm
+                return 0
+        if depth == 0:
+            return self.quiescence(gs, ply, alpha, beta)
+        self.nodes += 1
+        self.checkBudget()
+        if ply >= MAX_PLY - 1:
+            return ChessEvaluation.evaluate(gs)
+        hashMove = None
+        entry = self.tt.probe(gs.hash)
+        if entry is not None:
+            ttDepth, ttScore, ttBound, hashMove = entry
+            if ply > 0 and ttDepth >= depth:
+                ttScore = scoreFromTable(ttScore, ply)
+                if ttBound == EXACT or (ttBound == LOWER and ttScore >= beta) or (ttBound == UPPER and ttScore <= alpha):
+                    return ttScore
+        if hashMove is None and ply < len(self.rootPv):
+            hashMove = self.rootPv[ply].moveID
+        alphaOriginal = alpha
+        bestScore = -INFINITY
+        bestMove = None
+        legalMoves = 0
+        for move in self.orderedMoves(gs, ply, hashMove):
+            gs.makeMove(move)
+            try:
+                if gs.moveLeftKingInCheck():    # legality is only checked for moves we actually get round to
+                    continue
+                legalMoves += 1
+                score = -self.negamax(gs, depth - 1, ply + 1, -beta, -alpha)
+            finally:
+                gs.undoMove()
+            if score > bestScore:
+                bestScore = score
+                bestMove = move
+                if score > alpha:
+                    alpha = score
+                    self.pvTable[ply] = [move] + self.pvTable[ply + 1]
+                    if alpha >= beta:
+                        self.cutoffs += 1
+                        if move.pieceCaptured == "--":     # quiet move caused a cutoff, remember it
+                            self.storeKiller(move, ply)
+                            key = (move.pieceMoved, move.endRow, move.endCol)
+                            self.history[key] = self.history.get(key, 0) + depth * depth
+                        break
+        if legalMoves == 0:
+            return -MATE_SCORE + ply if gs.kingAttacked(gs.whiteToMove) else 0   # checkmate, or stalemate
+        bound = UPPER if bestScore <= alphaOriginal else LOWER if bestScore >= beta else EXACT
+        self.tt.store(gs.hash, depth, scoreToTable(bestScore, ply), bound, bestMove.moveID)
+        return bestScore
+
+    '''
+    Search captures and promotions only until the position is quiet. In check every move is searched instead, since
+    standing pat isn't an option there.
+    '''
+    def quiescence(self, gs, ply, alpha, beta):
+        self.nodes += 1
+        self.qnodes += 1
+        self.checkBudget()
+        self.pvTable[ply] = []
+        if ply >= MAX_PLY - 1:
+            return ChessEvaluation.evaluate(gs)
+        inCheck = gs.kingAttacked(gs.whiteToMove)
+        if inCheck:
+            bestScore = -INFINITY
+            moves = self.orderedMoves(gs, ply, None)
+        else:
+            bestScore = standPat = ChessEvaluation.evaluate(gs)
+            if standPat >= beta:
+                return standPat
+            alpha = max(alpha, standPat)
+            moves = gs.generateCaptures()
+            moves.sort(key=lambda m: self.orderScore(m, ply), reverse=True)
+        legalMoves = 0
+        for move in moves:
+            if not inCheck:
+                gain = PIECE_VALUES[move.pieceCaptured[1]] if move.pieceCaptured != "--" else 0
+                if move.isPawnPromotion:
+                    gain += PIECE_VALUES[move.promotionChoice] - PIECE_VALUES["P"]
+                if standPat + gain + DELTA_MARGIN <= alpha or staticExchange(gs, move) < 0:
+                    continue    # can't raise alpha, or loses material
+            gs.makeMove(move)
+            try:
+                if gs.moveLeftKingInCheck():
+                    continue
+                legalMoves += 1
+                score = -self.quiescence(gs, ply + 1, -beta, -alpha)
+            finally:
+                gs.undoMove()
+            if score > bestScore:
+                bestScore = score
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        break
+        if inCheck and legalMoves == 0:
+            return -MATE_SCORE + ply    # checkmate
+        return bestScore
+
+    '''
+    Yields pseudo-legal moves in the order they should be tried: the hash move, then captures and promotions, then
+    quiet moves. Each stage is generated only when the one before is used up, so a cutoff on the hash move or a
+    capture saves generating the rest.
+    '''
+    def orderedMoves(self, gs, ply, hashMove):
+        if hashMove is not None:
+            move = gs.findPseudoLegalMove(hashMove)
+            if move is None:
+                hashMove = None     # a hash collision, or a stale line from the previous iteration
+            else:
+                yield move
+        for stage in gs.generatePseudoLegalMoves():
+            stage.sort(key=lambda m: self.orderScore(m, ply), reverse=True)
+            for move in stage:
+                if move.moveID != hashMove:
+                    yield move
+
+    def storeKiller(self, move, ply):
+        if self.killers[ply][0] != move:
+            self.killers[ply][1] = self.killers[ply][0]
+            self.killers[ply][0] = move
+
+    '''
+    Higher scores are searched first: captures by MVV-LVA, killer moves, then history
+    '''
+    def orderScore(self, move, ply):
+        if move.pieceCaptured != "--" or move.isPawnPromotion:
+            gain = PIECE_VALUES[move.pieceCaptured[1]] if move.pieceCaptured != "--" else 0
+            if move.isPawnPromotion:
+                gain += PIECE_VALUES[move.promotionChoice]
+            return 2000000 + 10 * gain - PIECE_VALUES[move.pieceMoved[1]]
+        if move == self.killers[ply][0]:
+            return 1000002
+        if move == self.killers[ply][1]:
+            return 1000001
+        return min(self.history.get((move.pieceMoved, move.endRow, move.endCol), 0), 1000000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search a position for the best move")
+    parser.add_argument("--fen", default=ChessEngine.START_FEN)
+    parser.add_argument("--time", type=float, default=5.0, help="seconds to search")
+    parser.add_argument("--nodes", type=int, help="node budget")
+    parser.add_argument("--depth", type=int, default=MAX_PLY - 1)
+    parser.add_argument("--hash", type=int, default=16, help="transposition table size in MB")
+    parser.add_argument("--bitboards", action="store_true", help="use the bitboard backend")
+    parser.add_argument("--book", help="opening book to play from before searching")
+    parser.add_argument("--tablebases", help="directory of endgame tablebases to score small endgames with")
+    parser.add_argument("--verify-pv", action="store_true", help="check every iteration's PV is a line of legal moves")
+    args = parser.parse_args()
+
+    gs = ChessEngine.GameState.fromFen(args.fen, args.bitboards)
+    if args.book:
+        book = ChessBook.OpeningBook(args.book)
+        try:
+            move = book.chooseMove(gs)
+        finally:
+            book.close()
+        if move is not None:
+            print("bestmove " + move.getUciNotation() + " (book)")
+            return
+
+    def printIteration(result):
+        print(f"depth {result.depth} score {result.score} nodes {result.nodes} nps {result.nodesPerSecond():,.0f} "
+              f"ebf {result.branchingFactor():.2f} pv {result.getPvNotation()}")
+        if args.verify_pv:
+            checkPv(gs, result.pv)
+
+    searcher = Searcher(args.hash)
+    if args.tablebases:
+        searcher.tablebases = ChessTablebase.Tablebases(args.tablebases)
+    try:
+        result = searcher.search(gs, args.time, args.nodes, args.depth, printIteration)
+    finally:
+        if searcher.tablebases is not None:
+            searcher.tablebases.close()
+    stats = searcher.tt.getStats()
+    print(f"quiescence nodes {result.qnodes} of {result.nodes}")
+    if args.tablebases:
+        print(f"tablebase hits {result.tbHits}")
+    print(f"hash hits {stats['hits']} misses {stats['misses']} overwrites {stats['overwrites']} "
+          f"hit rate {stats['hitRate']:.1%} full {searcher.tt.hashfull()}/1000")
+    stats = ChessEvaluation.PAWN_CACHE.getStats()
+    print(f"pawn cache hits {stats['hits']} misses {stats['misses']} hit rate {stats['hitRate']:.1%}")
+    print("bestmove " + result.getPvNotation().split(" ")[0])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,408 @@
+"""
+Endgame tablebases for small sets of material, generated by retrograde analysis. A table holds every placement of its
+pieces with either side to move, indexed directly by the squares:
+    index = (side to move, 0 for white) * 64**n + square of piece 0 * 64**(n-1) + ... + square of piece n-1
+with the pieces in the order of the table's name, white's first (e.g. KRK is white king, white rook, black king).
+Two files per table: <name>.wdl packs a 2-bit win/draw/loss value per index (0 marking impossible positions) and
+<name>.dtm a byte per index with the distance to mate in plies. Both are memory-mapped, so a probe is a couple of
+byte reads.
+Tables are named with the stronger side as white; positions where black is stronger are looked up colour-flipped.
+Generation reuses the bitboard move generator. Every position is scanned once for its legal moves (in parallel over
+worker processes), moves that capture or promote are looked up in the smaller tables they lead to, which are
+generated first, and then results are propagated backwards from the mates one ply at a time, un-making moves to find
+each position's predecessors. Anything left unresolved at the end is a draw.
+    python -m Chess.ChessTablebase generate KQK KRK KPK --dir tablebases --workers 4
+    python -m Chess.ChessTablebase probe --dir tablebases --fen "8/8/8/4k3/8/8/8/4KR2 w - - 0 1"
+Three-piece tables take a minute or so each. Four-piece tables are 64 times larger and take hours in pure Python.
+"""
+import argparse
+import concurrent.futures
+import mmap
+import multiprocessing
+import os
+import time
+from Chess import ChessBitboard
+from Chess import ChessEngine
+
+INVALID, LOSS, DRAW, WIN = 0, 1, 2, 3   # for the side to move
+PENDING = 4     # only during generation: not resolved yet
+NO_DTM = 255
+WDL_NAMES = {LOSS: "loss", DRAW: "draw", WIN: "win"}
+PIECE_ORDER = "KQRBNP"
+MATERIAL_VALUES = {"K": 0, "Q": 9, "R": 5, "B": 3, "N": 3, "P": 1}
+DRAWN = ("KK", "KBK", "KNK")    # can't be won, so no table is needed
+CHUNK = 4096    # positions per task in the parallel scan
+
+# tables for the captures and promotions in the scan, opened once per worker process
+_tablebases = None
+
+
+'''
+Split a table name such as "KRKP" into the white and black pieces, "KR" and "KP"
+'''
+def splitSignature(signature):
+    second = signature.index("K", 1)
+    return signature[:second], signature[second:]
+
+
+'''
+The name a set of material is stored under, and whether the colours had to be swapped to get it
+'''
+def canonical(signature):
+    white, black = (sorted(side, key=PIECE_ORDER.index) for side in splitSignature(signature))
+    white, black = "".join(white), "".join(black)
+    whiteKey = (sum(MATERIAL_VALUES[p] for p in white), white)
+    blackKey = (sum(MATERIAL_VALUES[p] for p in black), black)
+    if blackKey > whiteKey:
+        return black + white, True
+    return white + black, False
+
+
+def tablePieces(signature):
+    white, black = splitSignature(signature)
+    return ["w" + p for p in white] + ["b" + p for p in black]
+
+
+def encode(whiteToMove, squares):
+    index = 0 if whiteToMove else 1
+    for sq in squares:
+        index = index * 64 + sq
+    return index
+
+
+def decode(index, n):
+    squares = [0] * n
+    for i in range(n - 1, -1, -1):
+        squares[i] = index & 63
+        index >>= 6
+    return index == 0, squares
+
+
+'''
+The tables a table's captures and promotions lead to, by their stored names
+'''
+def dependencies(signature):
+    white, black = splitSignature(signature)
+    results = set()
+    for side, other, isWhite in ((white, black, True), (black, white, False)):
+        join = (lambda ours, theirs: ours + theirs) if isWhite else (lambda ours, theirs: theirs + ours)
+        for i in range(1, len(side)):
+            results.add(canonical(join(side[:i] + side[i + 1:], other))[0])    # this piece captured
+            if side[i] == "P":  # promoted, possibly capturing as it does
+                for piece in "QRBN":
+                    promoted = side[:i] + piece + side[i + 1:]
+                    for rest in [other] + [other[:j] + other[j + 1:] for j in range(1, len(other))]:
+                        results.add(canonical(join(promoted, rest))[0])
+    return sorted(results - set(DRAWN))
+
+
+'''
+One mapped table file pair. value(index) returns (wdl, dtm).
+'''
+class Table():
+    def __init__(self, path):
+        self.files = [open(path + ".wdl", "rb"), open(path + ".dtm", "rb")]
+        self.wdl, self.dtm = (mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) for f in self.files)
+
+    def value(self, index):
+        return (self.wdl[index >> 2] >> ((index & 3) * 2)) & 3, self.dtm[index]
+
+    def close(self):
+        self.wdl.close()
+        self.dtm.close()
+        for f in self.files:
+            f.close()
+
+
+'''
+This class probes the tables found in a directory. Tables are mapped the first time they are needed.
+'''
+class Tablebases():
+    def __init__(self, directory):
+        self.directory = directory
+        self.tables = {}
+        names = [name[:-4] for name in os.listdir(directory) if name.endswith(".wdl")] if os.path.isdir(directory) else []
+        self.maxPieces = max([len(name) for name in names] + [3])   # KBK and KNK are always known
+        self.hits = 0
+
+    def getTable(self, signature):
+        if signature not in self.tables:
+            path = os.path.join(self.directory, signature)
+            self.tables[signature] = Table(path) if os.path.exists(path + ".wdl") else None
+        return self.tables[signature]
+
+    def close(self):
+        for table in self.tables.values():
+            if table is not None:
+                table.close()
+        self.tables = {}
+
+    '''
+    (wdl, dtm) for the side to move, given the pieces as (piece, square) pairs, or None if there is no table for them
+    '''
+    def probePieces(self, pieces, whiteToMove):
+        order = lambda entry: (entry[0][0] != "w", PIECE_ORDER.index(entry[0][1]))
+        ordered = sorted(pieces, key=order)
+        name, mirrored = canonical("".join(piece[1] for piece, sq in ordered))
+        if name in DRAWN:
+            return DRAW, 0
+        table = self.getTable(name)
+        if table is None:
+            return None
+        if mirrored:    # swap the colours and turn the board round
+            ordered = sorted([(("w" if piece[0] == "b" else "b") + piece[1], sq ^ 56) for piece, sq in pieces], key=order)
+            whiteToMove = not whiteToMove
+        return table.value(encode(whiteToMove, [sq for piece, sq in ordered]))
+
+    '''
+    (wdl, dtm) for the side to move in gs, or None if it isn't covered. Positions with castling rights or an en
+    passant capture available aren't in the tables.
+    '''
+    def probe(self, gs):
+        if gs.castlingRights:
+            return None
+        if gs.enpassantPossible != ():
+            row, col = gs.enpassantPossible
+            pawnRow, pawn = (row + 1, "wP") if gs.whiteToMove else (row - 1, "bP")
+            if any(0 <= c < 8 and gs.board[pawnRow][c] == pawn for c in (col - 1, col + 1)):
+                return None
+        pieces = []
+        if gs.bitboards is not None:
+            for piece, bb in gs.bitboards.pieces.items():
+                for sq in ChessBitboard.squares(bb):
+                    pieces.append((piece, sq))
+        else:
+            for row in range(8):
+                for col in range(8):
+                    if gs.board[row][col] != "--":
+                        pieces.append((gs.board[row][col], row * 8 + col))
+                        if len(pieces) > self.maxPieces:
+                            return None
+        if len(pieces) > self.maxPieces:
+            return None
+        result = self.probePieces(pieces, gs.whiteToMove)
+        if result is not None:
+            self.hits += 1
+        return result
+
+
+'''
+Scan positions start to stop of a table: whether each is possible, and what its legal moves lead to.
+Returns (start, status, remaining, exitWin, maxLoss) as bytes, per position:
+    status: INVALID, DRAW for stalemate or PENDING
+    remaining: moves whose result isn't yet known to lose, i.e. moves within the table and drawing captures
+    exitWin: shortest win in plies through a capture or promotion, NO_DTM if there is none
+    maxLoss: longest loss in plies through the moves known to lose so far (0 for checkmate)
+'''
+def scanChunk(signature, directory, start, stop):
+    global _tablebases
+    if _tablebases is None or _tablebases.directory != directory:
+        _tablebases = Tablebases(directory)
+    pieces = tablePieces(signature)
+    n = len(pieces)
+    status = bytearray(stop - start)
+    remaining = bytearray(stop - start)
+    exitWin = bytearray([NO_DTM]) * (stop - start)
+    maxLoss = bytearray(stop - start)
+    for index in range(start, stop):
+        whiteToMove, squares = decode(index, n)
+        if len(set(squares)) < n or ChessBitboard.KING_ATTACKS[squares[0]] & (1 << squares[pieces.index("bK")]):
+            continue    # two pieces on one square, or the kings touching
+        if any(piece[1] == "P" and sq // 8 in (0, 7) for piece, sq in zip(pieces, squares)):
+            continue    # pawns can't stand on the first or last rank
+        bitboards = ChessBitboard.Bitboards()
+        for piece, sq in zip(pieces, squares):
+            bitboards.addPiece(piece, sq)
+        us, them = ("w", "b") if whiteToMove else ("b", "w")
+        if bitboards.kingAttacked(them):
+            continue    # the side that just moved can't be in check
+        i = index - start
+        status[i] = PENDING
+        codes, inCheck = bitboards.generateMoves(whiteToMove, None)
+        if not codes and not inCheck:
+            status[i] = DRAW    # stalemate. Checkmate is PENDING with nothing remaining, a loss in 0
+            continue
+        for code in codes:
+            frm, to, promotion = code & 63, (code >> 6) & 63, code >> ChessBitboard.PROMOTION_SHIFT
+            if to not in squares and not promotion:
+                remaining[i] += 1
+                continue
+            mover = squares.index(frm)
+            moved = us + ChessEngine.Move.promotionPieces[promotion - 1] if promotion else pieces[mover]
+            child = [(moved if k == mover else pieces[k], to if k == mover else squares[k])
+                     for k in range(n) if squares[k] != to]
+            result = _tablebases.probePieces(child, not whiteToMove)
+            if result is None:
+                raise RuntimeError(f"{signature}: no table for the material after {pieces[mover]} {frm}-{to}")
+            wdl, dtm = result
+            if wdl == LOSS:
+                exitWin[i] = min(exitWin[i], dtm + 1)
+            elif wdl == WIN:
+                maxLoss[i] = max(maxLoss[i], dtm + 1)
+            else:
+                remaining[i] += 1   # a drawing capture, so this position can't be lost
+    return start, bytes(status), bytes(remaining), bytes(exitWin), bytes(maxLoss)
+
+
+'''
+Indexes of the positions the side not to move could have come from, by un-making a move that stayed in the table
+'''
+def predecessors(whiteToMove, squares, pieces):
+    moverColour = "b" if whiteToMove else "w"
+    occupied = 0
+    for sq in squares:
+        occupied |= 1 << sq
+    for i, piece in enumerate(pieces):
+        if piece[0] != moverColour:
+            continue
+        sq = squares[i]
+        kind = piece[1]
+        if kind == "P":
+            back = 8 if moverColour == "w" else -8
+            froms = []
+            if 1 <= (sq + back) // 8 <= 6 and not occupied & (1 << (sq + back)):
+                froms.append(sq + back)
+                if sq // 8 == (4 if moverColour == "w" else 3) and not occupied & (1 << (sq + 2 * back)):
+                    froms.append(sq + 2 * back)
+        else:
+            targets = 0
+            if kind == "K":
+                targets = ChessBitboard.KING_ATTACKS[sq]
+            elif kind == "N":
+                targets = ChessBitboard.KNIGHT_ATTACKS[sq]
+            if kind in ("R", "Q"):
+                targets |= ChessBitboard.rookAttacks(sq, occupied)
+            if kind in ("B", "Q"):
+                targets |= ChessBitboard.bishopAttacks(sq, occupied)
+            froms = ChessBitboard.squares(targets & ~occupied)
+        for frm in froms:
+            squares[i] = frm
+            yield encode(not whiteToMove, squares)
+        squares[i] = sq
+
+
+'''
+Generate a table and, first, any it depends on that the directory doesn't have yet
+'''
+def generate(signature, directory, workers=None, log=print):
+    name = canonical(signature)[0]
+    path = os.path.join(directory, name)
+    if name in DRAWN or os.path.exists(path + ".wdl"):
+        return
+    for dependency in dependencies(name):
+        generate(dependency, directory, workers, log)
+    os.makedirs(directory, exist_ok=True)
+    workers = workers or multiprocessing.cpu_count()
+    pieces = tablePieces(name)
+    n = len(pieces)
+    size = 2 * 64 ** n
+    start = time.perf_counter()
+
+    status = bytearray(size)
+    remaining = bytearray(size)
+    pendingWin = bytearray(size)
+    maxLoss = bytearray(size)
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        chunks = range(0, size, CHUNK)
+        for first, chunkStatus, chunkRemaining, chunkWin, chunkLoss in pool.map(
+                scanChunk, [name] * len(chunks), [directory] * len(chunks), chunks,
+                [min(first + CHUNK, size) for first in chunks]):
+            last = first + len(chunkStatus)
+            status[first:last] = chunkStatus
+            remaining[first:last] = chunkRemaining
+            pendingWin[first:last] = chunkWin
+            maxLoss[first:last] = chunkLoss
+    scanned = time.perf_counter()
+
+    # buckets[d] holds positions that may be resolved at d plies to mate, handled in order of d so the first result
+    # reached for a position is its shortest win or longest loss
+    buckets = [[] for _ in range(NO_DTM + 1)]
+    for index in range(size):
+        if status[index] == PENDING:
+            if pendingWin[index] != NO_DTM:
+                buckets[pendingWin[index]].append(index)
+            elif remaining[index] == 0:
+                buckets[maxLoss[index]].append(index)
+    dtm = bytearray([NO_DTM]) * size
+    for d in range(NO_DTM):
+        for index in buckets[d]:
+            if status[index] != PENDING:
+                continue
+            if pendingWin[index] == d:
+                result = WIN
+            elif remaining[index] == 0 and maxLoss[index] == d:
+                result = LOSS
+            else:
+                continue    # a stale entry, the position was queued again for a better result
+            status[index] = result
+            dtm[index] = d
+            whiteToMove, squares = decode(index, n)
+            for previous in predecessors(whiteToMove, squares, pieces):
+                if status[previous] != PENDING:
+                    continue
+                if result == LOSS:      # the move here wins for the side that made it
+                    if pendingWin[previous] > d + 1:
+                        pendingWin[previous] = d + 1
+                        buckets[d + 1].append(previous)
+                else:                   # the move here loses, one fewer way out
+                    remaining[previous] -= 1
+                    maxLoss[previous] = max(maxLoss[previous], d + 1)
+                    if remaining[previous] == 0 and pendingWin[previous] == NO_DTM:
+                        buckets[maxLoss[previous]].append(previous)
+        buckets[d] = None
+
+    packed = bytearray((size + 3) // 4)
+    counts = {LOSS: 0, DRAW: 0, WIN: 0}
+    for index in range(size):
+        value = status[index]
+        if value == PENDING:
+            value = DRAW    # neither side can force anything
+        if value != INVALID:
+            counts[value] += 1
+            packed[index >> 2] |= value << ((index & 3) * 2)
+    with open(path + ".dtm", "wb") as f:
+        f.write(dtm)
+    with open(path + ".wdl", "wb") as f:     # written last, its presence marks the table as complete
+        f.write(packed)
+    log(f"{name}: {counts[WIN]} wins, {counts[DRAW]} draws, {counts[LOSS]} losses for the side to move, "
+        f"longest mate {max(d for d in dtm if d != NO_DTM)} plies; scan {scanned - start:.1f}s, "
+        f"propagation {time.perf_counter() - scanned:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate or probe endgame tablebases")
+    commands = parser.add_subparsers(dest="command", required=True)
+    generateCommand = commands.add_parser("generate", help="generate tables, and the smaller ones they need")
+    generateCommand.add_argument("tables", nargs="+", help="material such as KQK, KRK, KPK or KRKP")
+    generateCommand.add_argument("--dir", default="tablebases")
+    generateCommand.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+    probeCommand = commands.add_parser("probe", help="look up a position")
+    probeCommand.add_argument("--dir", default="tablebases")
+    probeCommand.add_argument("--fen", required=True)
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        for table in args.tables:
+            generate(table, args.dir, args.workers)
+        return
+    tablebases = Tablebases(args.dir)
+    try:
+        gs = ChessEngine.GameState.fromFen(args.fen)
+        result = tablebases.probe(gs)
+        if result is None:
+            print("not in the tablebases")
+            return
+        repeats = 10000
+        start = time.perf_counter()
+        for _ in range(repeats):
+            tablebases.probe(gs)
+        elapsed = time.perf_counter() - start
+        wdl, dtm = result
+        print(WDL_NAMES.get(wdl, "impossible position") + (f", mate in {dtm} plies" if wdl != DRAW and dtm != NO_DTM else ""))
+        print(f"probe {elapsed / repeats * 1e6:.1f} microseconds")
+    finally:
+        tablebases.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+A fixed-size transposition table keyed by the 64-bit Zobrist hash of a position.
+Entries are packed into a flat buffer of unsigned 64-bit words rather than dicts of objects, two words per entry:
+    word 0: key XOR word 1, so a slot whose two words don't belong together never matches a probe
+    word 1: moveID (16 bits) | score + 2**31 (32 bits) | depth (8 bits) | bound (2 bits) | generation (6 bits)
+Slots come in buckets of two. The first is depth-preferred and only gives way to deeper results or to entries from
+an older search, the second always takes whatever the first one turned down.
+"""
+
+EXACT = 0   # the score is the position's value
+LOWER = 1   # the search failed high, the value is at least the score
+UPPER = 2   # the search failed low, the value is at most the score
+
+ENTRY_BYTES = 16
+NO_MOVE = 0xFFFF
+
+
+'''
+Bytes of table for a memory budget: a power of two number of two-entry buckets, so the index is a mask of the key
+'''
+def tableBytes(sizeMb):
+    buckets = 1
+    while buckets * 4 * ENTRY_BYTES <= sizeMb * 1024 * 1024:
+        buckets *= 2
+    return buckets * 2 * ENTRY_BYTES
+
+
+'''
+The table can live in a caller-supplied buffer of tableBytes(sizeMb) bytes, e.g. shared memory that several search
+processes use at once. Torn writes from concurrent stores just fail the key check on the next probe.
+'''
+class TranspositionTable():
+    def __init__(self, sizeMb=16, buffer=None):
+        if buffer is None:
+            buffer = bytearray(tableBytes(sizeMb))
+        self.slots = memoryview(buffer).cast("B").cast("Q")
+        self.bucketMask = len(self.slots) // 4 - 1
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.overwrites = 0     # stores that evicted a different position
+
+    def sizeInEntries(self):
+        return len(self.slots) // 2
+
+    def clear(self):
+        self.slots.cast("B")[:] = bytes(len(self.slots) * 8)
+        self.generation = 0
+        self.hits = self.misses = self.stores = self.overwrites = 0
+
+    '''
+    Called at the start of each search so entries left from earlier searches can be replaced first
+    '''
+    def newSearch(self):
+        self.generation = (self.generation + 1) & 63
+
+    '''
+    Returns (depth, score, bound, moveID) for the position with this key, or None if it isn't stored.
+    moveID is None when no best move was recorded.
+    '''
+    def probe(self, key):
+        slots = self.slots
+        i = (key & self.bucketMask) * 4
+        for j in (i, i + 2):
+            data = slots[j + 1]
+            if slots[j] ^ data == key:
+                self.hits += 1
+                move = data & 0xFFFF
+                return (data >> 48) & 0xFF, ((data >> 16) & 0xFFFFFFFF) - 2**31, (data >> 56) & 3, \
+                    None if move == NO_MOVE else move
+        self.misses += 1
+        return None
+
+    def store(self, key, depth, score, bound, moveID=None):
+        slots = self.slots
+        i = (key & self.bucketMask) * 4
+        data = (NO_MOVE if moveID is None else moveID) | ((score + 2**31) << 16) | (min(depth, 255) << 48) | \
+               (bound << 56) | (self.generation << 58)
+        preferred = slots[i + 1]
+        preferredKey = slots[i] ^ preferred
+        if preferredKey == key or depth >= (preferred >> 48) & 0xFF or (preferred >> 58) != self.generation:
+            j = i
+        else:
+            j = i + 2
+        old = slots[j + 1]
+        oldKey = slots[j] ^ old
+        if old and oldKey != key:
+            self.overwrites += 1
+        if moveID is None and oldKey == key and old & 0xFFFF != NO_MOVE:   # keep the best move we already had
+            data = (data & ~0xFFFF) | (old & 0xFFFF)
+        slots[j] = key ^ data
+        slots[j + 1] = data
+        self.stores += 1
+
+    '''
+    Permille of sampled slots filled by the current search
+    '''
+    def hashfull(self):
+        sample = min(1000, len(self.slots) // 2)
+        filled = sum(1 for j in range(sample) if self.slots[2 * j + 1] and (self.slots[2 * j + 1] >> 58) == self.generation)
+        return filled * 1000 // sample
+
+    def getStats(self):
+        probes = self.hits + self.misses
+        return {"entries": self.sizeInEntries(), "hits": self.hits, "misses": self.misses, "stores": self.stores,
+                "overwrites": self.overwrites, "hitRate": self.hits / probes if probes else 0.0}
@@ -0,0 +1,289 @@
+"""
+UCI (Universal Chess Interface) front end, so the engine can be run by GUIs and match tools such as cutechess-cli.
+stdin is read on an asyncio event loop while the search runs on a thread, so stop, ponderhit and isready are handled
+while the engine is thinking. The GameState persists between commands: a position command that extends (or rewinds
+part of) the previous move list only makes or undoes the moves that differ, and the transposition table, killers and
+history carry over from search to search until ucinewgame.
+Pondering: "go ponder" searches without a time limit until ponderhit, which starts the clock on the search already
+running, or stop. bestmove is only sent for a ponder or infinite search once one of those arrives.
+    python -m Chess.ChessUci
+    cutechess-cli -engine cmd="python -m Chess.ChessUci" proto=uci ...
+Threads are Lazy SMP worker processes (see ChessParallel), since the GIL keeps threads on one core.
+"""
+import asyncio
+import concurrent.futures
+import sys
+import threading
+import time
+from Chess import ChessEngine
+from Chess import ChessParallel
+from Chess import ChessSearch
+
+ENGINE_NAME = "ChessBot"
+ENGINE_AUTHOR = "tyates97"
+OPTIONS = (     # name, type, default, min, max
+    ("Hash", "spin", 16, 1, 1024),
+    ("Threads", "spin", 1, 1, 64),
+    ("Ponder", "check", False, None, None),
+    ("Move Overhead", "spin", 30, 0, 5000),
+)
+STOP_CHECK_EVERY = 64   # nodes between looks at the stop signal, a few milliseconds of search
+GO_PARAMETERS = ("wtime", "btime", "winc", "binc", "movestogo", "movetime", "nodes", "depth")
+
+
+'''
+This class holds the engine's state between commands and answers them. Output goes through send(), which the search
+thread also uses for its info lines.
+'''
+class UciEngine():
+    def __init__(self, output=sys.stdout):
+        self.output = output
+        self.outputLock = threading.Lock()
+        self.options = {name: default for name, kind, default, low, high in OPTIONS}
+        self.searcher = None    # ParallelSearcher, built on first use and rebuilt when Hash or Threads change
+        self.executor = concurrent.futures.ThreadPoolExecutor(1)
+        self.gs = ChessEngine.GameState()
+        self.baseFen = ChessEngine.START_FEN
+        self.moves = []         # UCI moves played from baseFen to reach self.gs
+        self.searchTask = None
+        self.released = None    # asyncio.Event, set when a finished search may report its bestmove
+        self.pondering = False
+        self.infinite = False
+        self.ponderTime = None  # the time budget to start on ponderhit
+
+    def send(self, line):
+        with self.outputLock:
+            self.output.write(line + "\n")
+            self.output.flush()
+
+    def getSearcher(self):
+        if self.searcher is None:
+            self.searcher = ChessParallel.ParallelSearcher(self.options["Threads"], self.options["Hash"])
+            self.searcher.searcher.checkEvery = STOP_CHECK_EVERY
+        return self.searcher
+
+    def close(self):
+        if self.searcher is not None:
+            self.searcher.close()
+            self.searcher = None
+        self.executor.shutdown()
+
+    '''
+    Handle one line of input. Returns False on quit.
+    '''
+    async def handle(self, line):
+        tokens = line.split()
+        if not tokens:
+            return True
+        command, arguments = tokens[0], tokens[1:]
+        if command == "uci":
+            self.send(f"id name {ENGINE_NAME}")
+            self.send(f"id author {ENGINE_AUTHOR}")
+            for name, kind, default, low, high in OPTIONS:
+                if kind == "spin":
+                    self.send(f"option name {name} type spin default {default} min {low} max {high}")
+                else:
+                    self.send(f"option name {name} type check default {str(default).lower()}")
+            self.send("uciok")
+        elif command == "isready":
+            self.send("readyok")
+        elif command == "setoption":
+            await self.stopSearch()
+            self.setOption(arguments)
+        elif command == "ucinewgame":
+            await self.stopSearch()
+            if self.searcher is not None:
+                self.searcher.tt.clear()
+                self.searcher.searcher.killers = [[None, None] for _ in range(ChessSearch.MAX_PLY)]
+                self.searcher.searcher.history = {}
+        elif command == "position":
+            await self.stopSearch()
+            self.setPosition(arguments)
+        elif command == "go":
+            await self.stopSearch()
+            self.startSearch(arguments)
+        elif command == "stop":
+            await self.stopSearch()
+        elif command == "ponderhit":
+            self.ponderHit()
+        elif command == "quit":
+            await self.stopSearch()
+            return False
+        else:
+            self.send("info string unknown command " + command)
+        return True
+
+    def setOption(self, arguments):
+        if "name" not in arguments:
+            return
+        valueAt = arguments.index("value") if "value" in arguments else len(arguments)
+        name = " ".join(arguments[arguments.index("name") + 1:valueAt])
+        value = " ".join(arguments[valueAt + 1:])
+        for optionName, kind, default, low, high in OPTIONS:
+            if optionName.lower() == name.lower():
+                try:
+                    self.options[optionName] = min(max(int(value), low), high) if kind == "spin" else value.lower() == "true"
+                except ValueError:
+                    self.send(f"info string bad value {value} for {optionName}")
+                    return
+                if optionName in ("Hash", "Threads") and self.searcher is not None:
+                    self.searcher.close()
+                    self.searcher = None
+                return
+        self.send("info string unknown option " + name)
+
+    '''
+    position [startpos | fen <fen>] [moves <move> ...]. When the start is the same as last time only the moves after
+    the part both lists share are undone and made, so a game's position costs one or two moves per command rather
+    than a replay from the start.
+    '''
+    def setPosition(self, arguments):
+        movesAt = arguments.index("moves") if "moves" in arguments else len(arguments)
+        if arguments[:1] == ["fen"]:
+            fen = " ".join(arguments[1:movesAt])
+        else:
+            fen = ChessEngine.START_FEN
+        moves = arguments[movesAt + 1:]
+        if fen == self.baseFen:
+            shared = 0
+            while shared < min(len(moves), len(self.moves)) and moves[shared] == self.moves[shared]:
+                shared += 1
+            for _ in range(len(self.moves) - shared):
+                self.gs.undoMove()
+            del self.moves[shared:]
+        else:
+            try:
+                gs = ChessEngine.GameState.fromFen(fen)
+            except ValueError as e:
+                self.send(f"info string bad fen {fen}: {e}")
+                return
+            self.gs, self.baseFen, self.moves = gs, fen, []
+        for uci in moves[len(self.moves):]:
+            move = next((m for m in self.gs.getValidMoves() if m.getUciNotation() == uci), None)
+            if move is None:
+                self.send(f"info string illegal move {uci} in {self.gs.toFen()}")
+                return
+            self.gs.makeMove(move)
+            self.moves.append(uci)
+
+    '''
+    Seconds to spend on this move, or None to search until stopped
+    '''
+    def allocateTime(self, parameters):
+        overhead = self.options["Move Overhead"]
+        if "movetime" in parameters:
+            return max(parameters["movetime"] - overhead, 1) / 1000
+        remaining = parameters.get("wtime" if self.gs.whiteToMove else "btime")
+        if remaining is None:
+            return None
+        increment = parameters.get("winc" if self.gs.whiteToMove else "binc", 0)
+        budget = remaining / max(parameters.get("movestogo", 30), 1) + increment * 3 / 4
+        budget = min(budget, remaining / 2) - overhead     # never risk more than half the clock
+        return max(budget, 1) / 1000
+
+    def startSearch(self, arguments):
+        parameters = {}
+        for i, token in enumerate(arguments[:-1]):
+            if token in GO_PARAMETERS:
+                try:
+                    parameters[token] = int(arguments[i + 1])
+                except ValueError:
+                    pass
+        self.infinite = "infinite" in arguments
+        self.pondering = "ponder" in arguments
+        maxTime = self.allocateTime(parameters)
+        if self.pondering:  # the clock only starts on ponderhit
+            self.ponderTime, maxTime = maxTime, None
+        maxDepth = min(parameters.get("depth", ChessSearch.MAX_PLY - 1), ChessSearch.MAX_PLY - 1)
+        self.released = asyncio.Event()
+        if not (self.pondering or self.infinite):
+            self.released.set()
+        searcher = self.getSearcher()   # now, so a ponderhit in the same read finds it
+        searcher.searcher.stopAt = None
+        self.searchTask = asyncio.ensure_future(self.runSearch(searcher, maxTime, parameters.get("nodes"), maxDepth))
+
+    async def runSearch(self, searcher, maxTime, maxNodes, maxDepth):
+        start = time.perf_counter()
+        result = await asyncio.get_running_loop().run_in_executor(
+            self.executor, searcher.search, self.gs, maxTime, maxNodes, maxDepth, lambda r: self.sendInfo(r, start))
+        await self.released.wait()     # a ponder or infinite search waits for ponderhit or stop
+        if result.bestMove is None:
+            self.send("bestmove 0000")
+        elif len(result.pv) > 1:
+            self.send(f"bestmove {result.bestMove.getUciNotation()} ponder {result.pv[1].getUciNotation()}")
+        else:
+            self.send(f"bestmove {result.bestMove.getUciNotation()}")
+
+    def sendInfo(self, result, start):
+        if abs(result.score) >= ChessSearch.MATE_SCORE - ChessSearch.MAX_PLY:
+            plies = ChessSearch.MATE_SCORE - abs(result.score)
+            score = f"mate {(plies + 1) // 2 if result.score > 0 else -(plies // 2)}"
+        else:
+            score = f"cp {result.score}"
+        elapsed = time.perf_counter() - start
+        self.send(f"info depth {result.depth} score {score} nodes {result.nodes} "
+                  f"nps {int(result.nodes / elapsed) if elapsed > 0 else 0} time {int(elapsed * 1000)} "
+                  f"hashfull {self.searcher.tt.hashfull()} pv {result.getPvNotation()}")
+
+    '''
+    Stop any search and wait for its bestmove to be sent
+    '''
+    async def stopSearch(self):
+        if self.searchTask is None:
+            return
+        self.pondering = self.infinite = False
+        # the search may not have started yet, and clears stopSignal when it does; stopAt stays set
+        self.searcher.searcher.stopAt = time.perf_counter()
+        self.searcher.stopSignal.set()
+        self.released.set()
+        await self.searchTask
+        self.searchTask = None
+
+    '''
+    The opponent played the move we pondered on: keep searching, now against the clock
+    '''
+    def ponderHit(self):
+        if self.searchTask is None or not self.pondering:
+            return
+        self.pondering = False
+        if self.ponderTime is not None:
+            self.searcher.searcher.stopAt = time.perf_counter() + self.ponderTime
+        if not self.infinite:
+            self.released.set()
+
+
+async def readLines(stream):
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    try:
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), stream)
+    except ValueError:  # a regular file, which can't be watched, so read it on a thread instead
+        while True:
+            line = await loop.run_in_executor(None, stream.readline)
+            if not line:
+                return
+            yield line
+    else:
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            yield line.decode()
+
+
+async def serve(engine, stream):
+    try:
+        async for line in readLines(stream):
+            if not await engine.handle(line):
+                return
+        await engine.stopSearch()   # end of input counts as quit
+    finally:
+        engine.close()
+
+
+def main():
+    asyncio.run(serve(UciEngine(), sys.stdin))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Zobrist keys for GameState. A position's hash is the XOR of one random 64-bit key per (piece, square), one for black
+to move, one for the file of the en passant square and one per castling right held, so makeMove and undoMove can update it in O(1) by XORing the
+keys of whatever changed. computeHash builds the same value from scratch, to check the incremental one against.
+The pawn hash is the XOR of the pawns' keys alone, and keys caches of pawn structure evaluation.
+"""
+import random
+from Chess import ChessBitboard
+
+# fixed seed so hashes are stable between runs (opening books and cached results are keyed on them)
+_random = random.Random(0x5EED)
+PIECE_KEYS = {piece: [_random.getrandbits(64) for _ in range(64)]
+              for piece in ['wP', 'wR', 'wN', 'wB', 'wQ', 'wK', 'bP', 'bR', 'bN', 'bB', 'bQ', 'bK']}
+SIDE_KEY = _random.getrandbits(64)
+ENPASSANT_KEYS = [_random.getrandbits(64) for _ in range(8)]
+_castlingRightKeys = [_random.getrandbits(64) for _ in range(4)]
+# indexed by the castling rights bitmask, the XOR of the keys of the rights held
+CASTLING_KEYS = [0] * 16
+for _rights in range(16):
+    for _bit in range(4):
+        if _rights & (1 << _bit):
+            CASTLING_KEYS[_rights] ^= _castlingRightKeys[_bit]
+
+
+'''
+Key for the en passant field, which is () when no en passant capture is possible
+'''
+def enpassantKey(enpassantPossible):
+    return ENPASSANT_KEYS[enpassantPossible[1]] if enpassantPossible != () else 0
+
+
+'''
+XOR of the piece keys a move changes, placedPiece being what ended up on the landing square. Undoing the move XORs the same value.
+'''
+def moveKey(move, placedPiece):
+    key = PIECE_KEYS[move.pieceMoved][move.startRow * 8 + move.startCol] ^ PIECE_KEYS[placedPiece][move.endRow * 8 + move.endCol]
+    if move.isEnpassantMove:
+        key ^= PIECE_KEYS[move.pieceCaptured][move.startRow * 8 + move.endCol]
+    elif move.pieceCaptured != "--":
+        key ^= PIECE_KEYS[move.pieceCaptured][move.endRow * 8 + move.endCol]
+    if move.isCastleMove:
+        rookFrom, rookTo = ChessBitboard.CASTLE_ROOK_MOVES[move.endRow * 8 + move.endCol]
+        key ^= PIECE_KEYS[move.pieceMoved[0] + "R"][rookFrom] ^ PIECE_KEYS[move.pieceMoved[0] + "R"][rookTo]
+    return key
+
+
+'''
+XOR of the pawn keys a move changes, which is 0 unless a pawn moves, is captured or promotes
+'''
+def pawnMoveKey(move, placedPiece):
+    key = 0
+    if move.pieceMoved[1] == "P":
+        key = PIECE_KEYS[move.pieceMoved][move.startRow * 8 + move.startCol]
+        if placedPiece[1] == "P":
+            key ^= PIECE_KEYS[placedPiece][move.endRow * 8 + move.endCol]
+    if move.pieceCaptured[1] == "P":
+        key ^= PIECE_KEYS[move.pieceCaptured][move.startRow * 8 + move.endCol if move.isEnpassantMove else move.endRow * 8 + move.endCol]
+    return key
+
+
+'''
+Hash a GameState from scratch
+'''
+def computeHash(gs):
+    key = 0
+    for row in range(8):
+        for col in range(8):
+            if gs.board[row][col] != "--":
+                key ^= PIECE_KEYS[gs.board[row][col]][row * 8 + col]
+    if not gs.whiteToMove:
+        key ^= SIDE_KEY
+    return key ^ enpassantKey(gs.enpassantPossible) ^ CASTLING_KEYS[gs.castlingRights]
+
+
+'''
+Pawn hash of a GameState from scratch
+'''
+def computePawnHash(gs):
+    key = 0
+    for row in range(8):
+        for col in range(8):
+            if gs.board[row][col][1] == "P":
+                key ^= PIECE_KEYS[gs.board[row][col]][row * 8 + col]
+    return key